@@ -0,0 +1,50 @@
+from flacmanager.audio import LazyAudio, audioKind, firstValue, readFlacTags
+from flacmanager.editing import (
+        PRESETS,
+        RegexRule,
+        applyPresets,
+        applyPreview,
+        deleteUselessTags,
+        filterAudioFiles,
+        modifyMetadata,
+        orderAudioFiles,
+        previewRule,
+        )
+from flacmanager.artwork import addPicture
+from flacmanager.files import renameAudioFiles, sortAudioFiles
+from flacmanager.index import MetadataIndex, openMetadataIndex
+from flacmanager.scan import (
+        iterAudioDirectories,
+        iterAudioFiles,
+        parseAudioDirectories,
+        parseAudioFiles,
+        )
+from flacmanager.transaction import TagTransaction, reservePadding, saveAudio
+from flacmanager.ui import printMetadata
+
+__all__ = ["addPicture",
+           "applyPresets",
+           "applyPreview",
+           "audioKind",
+           "deleteUselessTags",
+           "filterAudioFiles",
+           "firstValue",
+           "iterAudioDirectories",
+           "iterAudioFiles",
+           "LazyAudio",
+           "MetadataIndex",
+           "modifyMetadata",
+           "openMetadataIndex",
+           "orderAudioFiles",
+           "parseAudioDirectories",
+           "parseAudioFiles",
+           "PRESETS",
+           "previewRule",
+           "printMetadata",
+           "readFlacTags",
+           "RegexRule",
+           "renameAudioFiles",
+           "reservePadding",
+           "saveAudio",
+           "sortAudioFiles",
+           "TagTransaction"]
@@ -0,0 +1,3 @@
+from flacmanager.cli import main
+
+main()
@@ -0,0 +1,378 @@
+import hashlib
+import io
+import os
+import struct
+
+from base64 import b64decode, b64encode
+
+from flacmanager.audio import LazyAudio, audioKind, flacBlocks
+from flacmanager.stats import recordIO
+from flacmanager.transaction import saveAudio
+from flacmanager.ui import console
+
+
+FLAC_BLOCK_PICTURE = 6
+PICTURE_COVER_FRONT = 3
+
+
+def probeImage(data):
+    # Returns (mime, width, height, depth, colors) read from the image
+    # header. Raises ValueError for anything that is not a known image.
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        width, height, bits, color_type = struct.unpack_from(">IIBB",
+                                                             data, 16)
+        channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type, 1)
+        colors = 0
+        offset = 8
+        while color_type == 3 and offset + 8 <= len(data):
+            length, kind = struct.unpack_from(">I4s", data, offset)
+            if kind == b"PLTE":
+                colors = length // 3
+                break
+            if kind == b"IDAT":
+                break
+            offset += 12 + length
+        return "image/png", width, height, bits * channels, colors
+    if data[:2] == b"\xff\xd8":
+        offset = 2
+        while offset + 4 <= len(data):
+            if data[offset] != 0xFF:
+                offset += 1
+                continue
+            marker = data[offset + 1]
+            if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+                offset += 2
+                continue
+            length, = struct.unpack_from(">H", data, offset + 2)
+            if (0xC0 <= marker <= 0xCF
+                    and marker not in (0xC4, 0xC8, 0xCC)):
+                bits, height, width, components = struct.unpack_from(
+                        ">BHHB", data, offset + 4)
+                return "image/jpeg", width, height, bits * components, 0
+            offset += 2 + length
+        raise ValueError("JPEG without a frame header")
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        width, height, packed = struct.unpack_from("<HHB", data, 6)
+        bits = (packed & 0x07) + 1
+        colors = 1 << bits if packed & 0x80 else 0
+        return "image/gif", width, height, bits, colors
+    if data[:2] == b"BM":
+        width, height = struct.unpack_from("<ii", data, 18)
+        bits, = struct.unpack_from("<H", data, 28)
+        colors = 0
+        if bits <= 8:
+            colors = struct.unpack_from("<I", data, 46)[0] or 1 << bits
+        return "image/bmp", width, abs(height), bits, colors
+    raise ValueError("unknown image format")
+
+
+def resizeImage(data, max_size, quality=90):
+    # Downsizes the image to fit in max_size pixels and recompresses it as
+    # a JPEG. Needs Pillow; the image is kept as is without it.
+    try:
+        from PIL import Image
+    except ImportError:
+        console.print("[bold yellow]Pillow is not installed, the cover art "
+                      "is embedded at its original size. It is installed "
+                      "by pip install .\\[resize].[/]")
+        return data
+    image = Image.open(io.BytesIO(data))
+    if max(image.size) <= max_size:
+        return data
+    image.thumbnail((max_size, max_size))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class CoverArt:
+    # The picture block is serialized once and the same bytes are written
+    # to every file, mutagen would otherwise encode it again for each save.
+    def __init__(self, data):
+        import mutagen.flac
+
+        mime, width, height, depth, colors = probeImage(data)
+        picture = mutagen.flac.Picture()
+        picture.type = PICTURE_COVER_FRONT
+        picture.mime = mime
+        picture.width = width
+        picture.height = height
+        picture.depth = depth
+        picture.colors = colors
+        picture.data = data
+        self.block = picture.write()
+        picture.write = lambda: self.block
+        self.picture = picture
+        self.digest = hashlib.sha1(data).digest()
+        self.comment = None
+
+    def vorbisComment(self):
+        if self.comment is None:
+            self.comment = b64encode(self.block).decode("ascii")
+        return self.comment
+
+
+def loadCoverArt(picture, max_size=None, quality=90):
+    try:
+        with open(picture, "rb") as image_data:
+            data = image_data.read()
+        if max_size:
+            data = resizeImage(data, max_size, quality)
+        return CoverArt(data)
+    except (OSError, ValueError, struct.error):
+        console.print(f"ERROR: {picture} is not a valid image file.")
+        return None
+
+
+def readFlacPictures(path):
+    # Returns (type, mime, offset, length) for every picture block, the
+    # image data itself is left in the file.
+    pictures = []
+    with open(path, "rb") as file:
+        for code, size in flacBlocks(file):
+            if code != FLAC_BLOCK_PICTURE:
+                continue
+            kind, length = struct.unpack(">II", file.read(8))
+            mime = file.read(length).decode("ascii", "replace")
+            length, = struct.unpack(">I", file.read(4))
+            file.seek(length + 16, 1)
+            length, = struct.unpack(">I", file.read(4))
+            pictures.append((kind, mime, file.tell(), length))
+    return pictures
+
+
+def hashFileRange(path, offset, length):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while length > 0:
+            chunk = file.read(min(length, 1048576))
+            if not chunk:
+                raise ValueError("truncated picture block")
+            digest.update(chunk)
+            length -= len(chunk)
+            recordIO(bytes_read=len(chunk))
+    return digest.digest()
+
+
+def readFlacFrontCover(path):
+    for kind, mime, offset, length in readFlacPictures(path):
+        if kind == PICTURE_COVER_FRONT:
+            return hashFileRange(path, offset, length)
+    return None
+
+
+def frontCoverDigest(audio):
+    import mutagen.flac
+
+    if audioKind(audio) == "FLAC":
+        if isinstance(audio, LazyAudio) and audio.audio is None:
+            try:
+                return readFlacFrontCover(audio.filename)
+            except (OSError, ValueError, struct.error):
+                return None
+        pictures = audio.pictures
+    else:
+        pictures = []
+        for value in audio.tags.get("metadata_block_picture", []):
+            try:
+                pictures.append(mutagen.flac.Picture(b64decode(value)))
+            except (ValueError, struct.error, mutagen.flac.error):
+                continue
+    for picture in pictures:
+        if picture.type == PICTURE_COVER_FRONT:
+            return hashlib.sha1(picture.data).digest()
+    return None
+
+
+def setCoverArt(audio, coverArt):
+    # Returns False when the file already has this front cover.
+    if frontCoverDigest(audio) == coverArt.digest:
+        return False
+    if audioKind(audio) == "FLAC":
+        audio.clear_pictures()
+        audio.add_picture(coverArt.picture)
+    else:
+        audio['metadata_block_picture'] = coverArt.vorbisComment()
+    return True
+
+
+def addPicture(picture, audio_files, max_size=None, quality=90):
+    from rich.prompt import Confirm
+
+    coverArt = loadCoverArt(picture, max_size, quality)
+    if coverArt is not None:
+        choice = Confirm.ask(f"{picture} will be the cover art for "
+                             f"{len(audio_files)} files. Proceed?")
+        if choice:
+            unchanged = 0
+            with console.status("Adding cover art..",
+                                spinner="line"):
+                for audio, path in audio_files:
+                    if setCoverArt(audio, coverArt):
+                        saveAudio(audio, True)
+                    else:
+                        unchanged += 1
+            if unchanged:
+                console.print(f"{unchanged} file(s) already had this "
+                              f"cover art.")
+
+
+PICTURE_NAMES = {3: "cover", 4: "back", 6: "media", 5: "leaflet", 8: "artist"}
+PICTURE_EXTENSIONS = {"image/jpeg": ".jpg",
+                      "image/jpg": ".jpg",
+                      "image/png": ".png",
+                      "image/gif": ".gif",
+                      "image/bmp": ".bmp"}
+
+
+def copyFileRange(path, offset, length, destination):
+    with open(path, "rb") as source, open(destination, "wb") as target:
+        source.seek(offset)
+        while length > 0:
+            chunk = source.read(min(length, 1048576))
+            if not chunk:
+                raise ValueError("truncated picture block")
+            target.write(chunk)
+            length -= len(chunk)
+            recordIO(bytes_read=len(chunk), bytes_written=len(chunk))
+
+
+def hashFile(path):
+    return hashFileRange(path, 0, os.path.getsize(path))
+
+
+class ArtExtractor:
+    # Writes every distinct embedded picture of an album directory once,
+    # as a sidecar next to the tracks. FLAC pictures are hashed and copied
+    # straight from the file in chunks, two reads being cheaper than
+    # holding every cover of the library in memory.
+    def __init__(self, strip=False):
+        self.strip = strip
+        self.sidecars = {}
+        self.known = {}
+        self.pictures = 0
+        self.embedded_bytes = 0
+        self.written = 0
+        self.written_bytes = 0
+        self.stripped = 0
+        self.stripped_bytes = 0
+        self.errors = []
+
+    def embedded(self, audio):
+        # Returns (type, mime, length, digest, source) for every picture,
+        # source being the image data or (path, offset) of it.
+        import mutagen.flac
+
+        if audioKind(audio) == "FLAC":
+            if isinstance(audio, LazyAudio) and audio.audio is None:
+                return [(kind,
+                         mime,
+                         length,
+                         hashFileRange(audio.filename, offset, length),
+                         (audio.filename, offset))
+                        for kind, mime, offset, length
+                        in readFlacPictures(audio.filename)]
+            pictures = audio.pictures
+        else:
+            pictures = []
+            for value in audio.tags.get("metadata_block_picture", []):
+                try:
+                    pictures.append(mutagen.flac.Picture(b64decode(value)))
+                except (ValueError, struct.error, mutagen.flac.error):
+                    continue
+        return [(picture.type,
+                 picture.mime,
+                 len(picture.data),
+                 hashlib.sha1(picture.data).digest(),
+                 picture.data)
+                for picture in pictures]
+
+    def sidecar(self, directory, kind, mime, length, digest, source):
+        sidecar = self.sidecars.get((directory, digest))
+        if sidecar is not None:
+            return sidecar
+        name = PICTURE_NAMES.get(kind, "picture")
+        extension = PICTURE_EXTENSIONS.get(mime.lower(), ".jpg")
+        number = 1
+        while True:
+            sidecar = directory / (name + extension if number == 1
+                                   else f"{name}-{number}{extension}")
+            if sidecar not in self.known and sidecar.exists():
+                self.known[sidecar] = hashFile(sidecar)
+            if sidecar not in self.known:
+                break
+            if self.known[sidecar] == digest:
+                self.sidecars[(directory, digest)] = sidecar
+                return sidecar
+            number += 1
+        if isinstance(source, tuple):
+            copyFileRange(*source, length, sidecar)
+        else:
+            with open(sidecar, "wb") as file:
+                file.write(source)
+            recordIO(bytes_written=length)
+        self.known[sidecar] = digest
+        self.sidecars[(directory, digest)] = sidecar
+        self.written += 1
+        self.written_bytes += length
+        return sidecar
+
+    def extract(self, audio, path):
+        try:
+            pictures = self.embedded(audio)
+            for kind, mime, length, digest, source in pictures:
+                self.sidecar(path.parent, kind, mime, length, digest, source)
+        except (OSError, ValueError, struct.error) as error:
+            self.errors.append((path, error))
+            return path
+        size = sum(picture[2] for picture in pictures)
+        self.pictures += len(pictures)
+        self.embedded_bytes += size
+        if self.strip and pictures:
+            if audioKind(audio) == "FLAC":
+                audio.clear_pictures()
+            else:
+                del audio.tags["metadata_block_picture"]
+            saveAudio(audio, True, True)
+            self.stripped += 1
+            self.stripped_bytes += size
+        return path
+
+    def report(self):
+        console.print(f"Wrote {self.written} sidecar(s) "
+                      f"({self.written_bytes / 1048576:.1f} MiB) for "
+                      f"{self.pictures} embedded picture(s) "
+                      f"({self.embedded_bytes / 1048576:.1f} MiB).")
+        # Picture bytes, not file sizes: the files keep some padding in
+        # place of the pictures to stay cheap to edit.
+        if self.strip:
+            console.print(f"Stripped the pictures of {self.stripped} "
+                          f"file(s), removing "
+                          f"{self.stripped_bytes / 1048576:.1f} MiB of "
+                          f"picture bytes.")
+        else:
+            console.print(f"Stripping the embedded copies would remove "
+                          f"{self.embedded_bytes / 1048576:.1f} MiB of "
+                          f"picture bytes.")
+        if self.errors:
+            console.print(f"[bold red]Could not extract the pictures of "
+                          f"{len(self.errors)} file(s):[/]")
+            for path, error in self.errors:
+                console.print(f"  {path} : {error}")
+
+
+def extractArt(audio_files, strip=False):
+    if strip:
+        from rich.prompt import Confirm
+
+        strip = Confirm.ask(f"This will remove the embedded pictures of "
+                            f"{len(audio_files)} files once they are "
+                            f"written as sidecars. Proceed?")
+    extractor = ArtExtractor(strip)
+    with console.status("Extracting cover art..", spinner="line"):
+        for audio, path in audio_files:
+            extractor.extract(audio, path)
+    extractor.report()
@@ -0,0 +1,275 @@
+import contextlib
+import struct
+import sys
+
+
+FLAC_BLOCK_STREAMINFO = 0
+FLAC_BLOCK_PADDING = 1
+FLAC_BLOCK_VORBIS_COMMENT = 4
+# Tags whose values repeat across a library, shared between the records
+# of every file instead of being held once per file.
+INTERNED_TAGS = frozenset(("album",
+                           "albumartist",
+                           "artist",
+                           "composer",
+                           "date",
+                           "discnumber",
+                           "disctotal",
+                           "genre",
+                           "totaldiscs",
+                           "totaltracks",
+                           "tracknumber",
+                           "tracktotal"))
+
+
+class CachedTags(dict):
+    # Mimics the parts of mutagen's VCommentDict the script relies on.
+    __slots__ = ()
+
+    def __init__(self, tags=()):
+        super().__init__()
+        for key, values in dict(tags).items():
+            self[key] = values
+
+    def __setitem__(self, key, value):
+        if isinstance(value, str):
+            value = [value]
+        key = sys.intern(key.lower())
+        if key in INTERNED_TAGS:
+            value = [sys.intern(item) if type(item) is str else item
+                     for item in value]
+        super().__setitem__(key, list(value))
+
+    def items(self):
+        return list(super().items())
+
+
+class LazyAudio:
+    # Tags served from the index; the mutagen object is only loaded when
+    # the file is actually going to be written.
+    __slots__ = ("filename", "tags", "kind", "audio", "placeholders")
+
+    def __init__(self, path, tags, kind):
+        self.filename = str(path)
+        self.tags = CachedTags(tags)
+        self.kind = kind
+        self.audio = None
+        self.placeholders = ()
+
+    def load(self):
+        if self.audio is None:
+            import mutagen
+            from mutagen import MutagenError
+
+            audio = mutagen.File(self.filename)
+            if audio is None:
+                raise MutagenError(f"{self.filename} is not an audio file.")
+            if audio.tags is None:
+                audio.add_tags()
+            for key in audio.tags.keys():
+                if key.lower() not in self.tags:
+                    del audio.tags[key]
+            for key, values in self.tags.items():
+                audio.tags[key] = values
+            self.audio = audio
+            self.tags = audio.tags
+        self.audio.filename = self.filename
+        return self.audio
+
+    def save(self, *args, **kwargs):
+        self.load().save(*args, **kwargs)
+
+    def release(self):
+        # Drops the mutagen object of a saved file, keeping its tags.
+        if self.audio is not None:
+            self.tags = CachedTags(self.audio.tags)
+            self.audio = None
+
+    def clear_pictures(self):
+        self.load().clear_pictures()
+
+    def add_picture(self, picture):
+        self.load().add_picture(picture)
+
+    @property
+    def pictures(self):
+        return self.load().pictures
+
+    def __setitem__(self, key, value):
+        self.load()[key] = value
+
+
+def audioKind(audio):
+    if isinstance(audio, LazyAudio):
+        return audio.kind
+    return type(audio).__name__
+
+
+def firstValue(audio, tag):
+    values = audio.tags.get(tag)
+    if values:
+        return values[0]
+    return None
+
+
+def ensureBasicTags(audio):
+    # The missing tags are only filled in memory: they are left out of the
+    # snapshots and of the saved file as long as they stay empty.
+    tags = ('artist',
+            'album',
+            'genre',
+            'tracknumber',
+            'title')
+    filled = list(getattr(audio, "placeholders", ()))
+    for tag in tags:
+        if tag not in audio.tags:
+            audio.tags[tag] = ""
+            filled.append(tag)
+    audio.placeholders = tuple(filled)
+
+
+def placeholderTags(audio):
+    return [tag for tag in getattr(audio, "placeholders", ())
+            if audio.tags.get(tag) == [""]]
+
+
+@contextlib.contextmanager
+def withoutPlaceholders(audio):
+    placeholders = placeholderTags(audio)
+    for tag in placeholders:
+        del audio.tags[tag]
+    try:
+        yield audio
+    finally:
+        for tag in placeholders:
+            audio.tags[tag] = ""
+
+
+def snapshotTags(audio):
+    placeholders = placeholderTags(audio)
+    tags = {}
+    for key, values in audio.tags.items():
+        if key.lower() not in placeholders:
+            tags.setdefault(key.lower(), []).extend(values)
+    return tags
+
+
+def vorbisTags(audio):
+    # Returns the tags as a plain dict when they are Vorbis comments, the
+    # only kind that can be stored as JSON and written back as is.
+    if not isinstance(audio.tags, CachedTags):
+        from mutagen._vorbis import VCommentDict
+
+        if not isinstance(audio.tags, VCommentDict):
+            return None
+    return snapshotTags(audio)
+
+
+def replaceTags(audio, tags):
+    for key in list(audio.tags.keys()):
+        del audio.tags[key]
+    for key, values in tags.items():
+        audio.tags[key] = values
+
+
+def parseVorbisComment(data):
+    vendor_length, = struct.unpack_from("<I", data, 0)
+    offset = 4 + vendor_length
+    count, = struct.unpack_from("<I", data, offset)
+    offset += 4
+    tags = {}
+    for _ in range(count):
+        length, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        entry = data[offset:offset + length].decode("utf-8", "replace")
+        offset += length
+        key, separator, value = entry.partition("=")
+        if separator:
+            tags.setdefault(key.lower(), []).append(value)
+    return tags
+
+
+def flacBlocks(file):
+    # Yields (code, size) for every metadata block with the file positioned
+    # at the start of its data, then seeks past it whatever the caller
+    # read. Raises ValueError when the file is not a well-formed FLAC.
+    magic = file.read(4)
+    if magic[:3] == b"ID3":
+        header = magic + file.read(6)
+        if len(header) < 10:
+            raise ValueError("truncated ID3 header")
+        size = 0
+        for byte in header[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        footer = 10 if header[5] & 0x10 else 0
+        file.seek(10 + size + footer)
+        magic = file.read(4)
+    if magic != b"fLaC":
+        raise ValueError("missing fLaC marker")
+    last = False
+    while not last:
+        header = file.read(4)
+        if len(header) < 4:
+            raise ValueError("truncated metadata block")
+        last = bool(header[0] & 0x80)
+        code = header[0] & 0x7F
+        size = int.from_bytes(header[1:4], "big")
+        start = file.tell()
+        yield code, size
+        file.seek(start + size)
+
+
+def readFlacTags(path):
+    # Walks the metadata block chain and only reads the VORBIS_COMMENT
+    # block, seeking past pictures, padding and the audio frames.
+    # Returns (tags, bytes read), tags being None whenever the file should
+    # be left to mutagen instead.
+    tags = {}
+    bytes_read = 4
+    with open(path, "rb") as file:
+        try:
+            for code, size in flacBlocks(file):
+                bytes_read += 4
+                if code == FLAC_BLOCK_VORBIS_COMMENT:
+                    data = file.read(size)
+                    bytes_read += len(data)
+                    if len(data) < size:
+                        return None, bytes_read
+                    tags = parseVorbisComment(data)
+        except (ValueError, struct.error):
+            return None, bytes_read
+    return tags, bytes_read
+
+
+def readFlacLayout(path):
+    # Returns (metadata size, padding size) where the metadata size is the
+    # room available between the fLaC marker and the first audio frame.
+    with open(path, "rb") as file:
+        start = None
+        padding = 0
+        for code, size in flacBlocks(file):
+            if start is None:
+                start = file.tell() - 4
+            if code == FLAC_BLOCK_PADDING:
+                padding += size
+        return file.tell() - start, padding
+
+
+def readFlacStreamInfo(path):
+    # Returns (sample rate, channels, bits per sample, total samples, MD5
+    # of the decoded audio) from the STREAMINFO block, which always comes
+    # first, without touching the audio frames.
+    with open(path, "rb") as file:
+        for code, size in flacBlocks(file):
+            if code != FLAC_BLOCK_STREAMINFO or size < 34:
+                raise ValueError("missing STREAMINFO block")
+            data = file.read(34)
+            if len(data) < 34:
+                raise ValueError("truncated STREAMINFO block")
+            fields = int.from_bytes(data[10:18], "big")
+            return (fields >> 44,
+                    ((fields >> 41) & 0x07) + 1,
+                    ((fields >> 36) & 0x1F) + 1,
+                    fields & 0xFFFFFFFFF,
+                    data[18:34].hex())
+    raise ValueError("missing STREAMINFO block")
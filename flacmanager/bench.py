@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+import time
+import timeit
+
+from pathlib import Path
+
+from flacmanager.audio import (
+        FLAC_BLOCK_PADDING,
+        FLAC_BLOCK_VORBIS_COMMENT,
+        LazyAudio,
+        ensureBasicTags,
+        )
+from flacmanager.editing import (
+        PRESETS,
+        RegexRule,
+        applyPresets,
+        filterAudioFiles,
+        previewRule,
+        )
+from flacmanager.files import renameAudioFiles, sortAudioFiles
+from flacmanager.scan import parseAudioDirectories, parseAudioPath
+from flacmanager.transaction import TagTransaction
+from flacmanager.ui import console, printMetadata
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else crc << 1
+    return crc
+
+
+def crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x8005) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def flacBlock(code, data, is_last=False):
+    header = code | (0x80 if is_last else 0)
+    return bytes([header]) + len(data).to_bytes(3, "big") + data
+
+
+def silentFlacFrame(number):
+    # One 4096 samples, 44.1kHz, 16 bits stereo frame made of two CONSTANT
+    # subframes. number must stay below 128 to fit in one UTF-8 byte.
+    header = bytes([0xFF, 0xF8, 0xC9, 0x18, number])
+    header += bytes([crc8(header)])
+    frame = header + b"\x00\x00\x00" * 2
+    return frame + crc16(frame).to_bytes(2, "big")
+
+
+def writeSyntheticFlac(path, tags, picture=b"", padding=1024, frames=1):
+    # Writes a small but valid FLAC stream of silence, so that both
+    # mutagen and decoders accept the generated files.
+    import mutagen.flac
+    import mutagen.id3
+
+    samples = 4096 * frames
+    audio = b"".join(silentFlacFrame(number) for number in range(frames))
+    frame_size = len(audio) // frames
+    streaminfo = struct.pack(">HH", 4096, 4096)
+    streaminfo += frame_size.to_bytes(3, "big") * 2
+    streaminfo += ((44100 << 44) | (1 << 41) | (15 << 36)
+                   | samples).to_bytes(8, "big")
+    streaminfo += hashlib.md5(bytes(samples * 4)).digest()
+    vendor = b"flacmanager"
+    comment = struct.pack("<I", len(vendor)) + vendor
+    comment += struct.pack("<I", len(tags))
+    for key, value in tags:
+        entry = f"{key}={value}".encode("utf-8")
+        comment += struct.pack("<I", len(entry)) + entry
+    blocks = flacBlock(0, streaminfo)
+    blocks += flacBlock(FLAC_BLOCK_VORBIS_COMMENT, comment)
+    if picture:
+        coverArt = mutagen.flac.Picture()
+        coverArt.type = mutagen.id3.PictureType.COVER_FRONT
+        coverArt.mime = u"image/jpeg"
+        coverArt.data = picture
+        blocks += flacBlock(6, coverArt.write())
+    blocks += flacBlock(FLAC_BLOCK_PADDING, bytes(padding), True)
+    with open(path, "wb") as file:
+        file.write(b"fLaC" + blocks + audio)
+
+
+def generateLibrary(root,
+                    count=1000,
+                    tag_size=32,
+                    picture_size=0,
+                    depth=2,
+                    tracks_per_album=10):
+    root = Path(root)
+    picture = os.urandom(picture_size) if picture_size else b""
+    for i in range(count):
+        album = i // tracks_per_album
+        track = i % tracks_per_album + 1
+        parts = []
+        if depth >= 2:
+            parts.append(f"Artist {album // 4:04}")
+            parts.extend(f"Disc {level}" for level in range(depth - 2))
+        if depth >= 1:
+            parts.append(f"Album {album:05}")
+        directory = root.joinpath(*parts)
+        directory.mkdir(parents=True, exist_ok=True)
+        tags = [("artist", f"Artist {album // 4:04}, Guest {i % 7}"),
+                ("album", f"Album {album:05} (Deluxe Edition)"),
+                ("genre", ("Rock; Pop", "Jazz", "Classical")[album % 3]),
+                ("tracknumber", str(track)),
+                ("title", f"track {i} (live)"),
+                ("comment", "x" * tag_size)]
+        writeSyntheticFlac(directory / f"{track:02}.flac", tags, picture)
+
+
+def benchmarkRules(count=10000, repeat=5):
+    # Per-file cost, in microseconds, of previewing every preset and of a
+    # filter on synthetic in-memory records, without touching the disk.
+    audio_files = []
+    for i in range(count):
+        path = Path(f"{i:06}.flac")
+        tags = {"artist": [f"Artist {i % 97}, Guest {i % 13}"],
+                "album": [f"album number {i % 211} (deluxe edition)"],
+                "genre": ["Rock; Pop"],
+                "tracknumber": [str(i % 20)],
+                "title": [f"some title {i} (live at the venue) *"]}
+        audio_files.append((LazyAudio(path, tags, "FLAC"), path))
+    results = {}
+    for preset, (target_tags, regex, replace) in PRESETS.items():
+        rule = RegexRule(regex, target_tags, replace)
+        best = min(timeit.repeat(lambda: previewRule(rule, audio_files),
+                                 number=1,
+                                 repeat=repeat))
+        results[f"preset {preset}"] = best / count * 1e6
+    pattern = re.compile(r'Artist 1\b')
+    target_tags = ("artist", "album", "genre", "tracknumber", "title")
+    best = min(timeit.repeat(
+        lambda: filterAudioFiles(audio_files, pattern, target_tags),
+        number=1,
+        repeat=repeat))
+    results["filter"] = best / count * 1e6
+    return results
+
+
+def peakMemory():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def memoryFootprint(paths):
+    # Returns the bytes held per file by the records the scan keeps and by
+    # full mutagen objects for the same files, as traced by tracemalloc.
+    import gc
+    import tracemalloc
+
+    import mutagen
+
+    paths = list(paths)
+    footprint = {}
+    for name, load in (("records", lambda path: parseAudioPath(path)[0]),
+                       ("mutagen", mutagen.File)):
+        # Parsing a first file keeps lazy imports out of the figures.
+        load(paths[0])
+        gc.collect()
+        tracemalloc.start()
+        try:
+            held = [load(path) for path in paths]
+            for audio in held:
+                ensureBasicTags(audio)
+            footprint[name] = (tracemalloc.get_traced_memory()[0]
+                               / len(paths))
+        finally:
+            tracemalloc.stop()
+        del held
+    return footprint
+
+
+def benchmark(count=1000,
+              tag_size=32,
+              picture_size=0,
+              depth=2,
+              directory=None):
+    from rich.console import Console
+
+    results = {"files": count,
+               "tag_size": tag_size,
+               "picture_size": picture_size,
+               "depth": depth,
+               "phases": {}}
+    # Everything printed while timing goes to a console writing to devnull.
+    quiet = Console(file=open(os.devnull, "w"))
+    loud, console.console = console.console, quiet
+    try:
+        with tempfile.TemporaryDirectory() as temporary:
+            root = Path(directory or temporary) / "library"
+            start = time.perf_counter()
+            generateLibrary(root, count, tag_size, picture_size, depth)
+            results["generate_seconds"] = time.perf_counter() - start
+            library_bytes = sum(path.stat().st_size
+                                for path in root.rglob("*.flac"))
+            results["library_bytes"] = library_bytes
+
+            def phase(name, function):
+                start = time.perf_counter()
+                value = function()
+                seconds = time.perf_counter() - start
+                results["phases"][name] = {
+                    "seconds": seconds,
+                    "files_per_second": count / seconds if seconds else None,
+                    "bytes_per_second":
+                        library_bytes / seconds if seconds else None,
+                    "peak_rss": peakMemory(),
+                }
+                return value
+
+            audio_files = phase("parseAudioDirectories",
+                                lambda: parseAudioDirectories([root], True))
+            pattern = re.compile(r'Artist 000\d')
+            phase("filterAudioFiles",
+                  lambda: filterAudioFiles(audio_files,
+                                           pattern,
+                                           ("artist", "album", "title")))
+
+            def presets():
+                with TagTransaction(audio_files):
+                    applyPresets(audio_files, tuple(PRESETS), True)
+            phase("applyPresets", presets)
+            audio_files = phase("renameAudioFiles",
+                                lambda: renameAudioFiles(audio_files))
+            audio_files = phase("sortAudioFiles",
+                                lambda: sortAudioFiles(audio_files,
+                                                       root.parent / "sorted"))
+            phase("printMetadata", lambda: printMetadata(audio_files))
+            results["memory_bytes_per_file"] = memoryFootprint(
+                    sorted((root.parent / "sorted").rglob("*.flac")))
+    finally:
+        console.console = loud
+        quiet.file.close()
+    results["rules_us_per_file"] = benchmarkRules()
+    return results
+
+
+def benchmarkMain(arguments):
+    bench_parser = argparse.ArgumentParser(
+            prog="flacmanager bench",
+            description='Times every operation on a synthetic library.')
+    bench_parser.add_argument("-n",
+                              "--files",
+                              type=int,
+                              default=1000,
+                              help='Number of files to generate.')
+    bench_parser.add_argument("--tag-size",
+                              type=int,
+                              default=32,
+                              metavar="BYTES",
+                              help='Size of the comment tag of every file.')
+    bench_parser.add_argument("--picture-size",
+                              type=int,
+                              default=0,
+                              metavar="BYTES",
+                              help='Size of the embedded front cover.')
+    bench_parser.add_argument("--depth",
+                              type=int,
+                              default=2,
+                              help='Directory depth of the library.')
+    bench_parser.add_argument("--directory",
+                              help='Generates the library in DIRECTORY '
+                                   'instead of the temporary directory.')
+    bench_parser.add_argument("-o",
+                              "--output",
+                              metavar="FILE",
+                              help='Writes the JSON results to FILE.')
+    bench_args = bench_parser.parse_args(arguments)
+    results = benchmark(bench_args.files,
+                        bench_args.tag_size,
+                        bench_args.picture_size,
+                        bench_args.depth,
+                        bench_args.directory)
+    output = json.dumps(results, indent=2)
+    if bench_args.output:
+        with open(bench_args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
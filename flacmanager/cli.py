@@ -0,0 +1,557 @@
+import argparse
+import cProfile
+import json
+import os
+import re
+import sys
+
+from flacmanager.editing import (
+        applyPresets,
+        deleteUselessTags,
+        filterAudioFiles,
+        modifyMetadata,
+        orderAudioFiles,
+        )
+from flacmanager.artwork import addPicture, extractArt
+from flacmanager.consistency import (
+        CONSISTENCY_TAGS,
+        applyEditFile,
+        consistencyReport,
+        readEdits,
+        )
+from flacmanager.dupes import findDuplicates, printDuplicates
+from flacmanager.export import EXPORT_FORMATS, exportMetadata, openExporter
+from flacmanager.files import (
+        DEFAULT_NAME_TEMPLATE,
+        SORT_MODES,
+        nameTemplate,
+        renameAudioFiles,
+        sortAudioFiles,
+        )
+from flacmanager.index import openMetadataIndex
+from flacmanager.journal import WriteJournal, journalMain
+from flacmanager.pipeline import streamAudioFiles, streamStages
+from flacmanager.query import Query, QueryError
+from flacmanager.scan import (
+        iterAudioDirectories,
+        iterAudioFiles,
+        parseAudioDirectories,
+        parseAudioFiles,
+        reportReadErrors,
+        )
+from flacmanager.shard import SHARD_MODES, Shard, parseShard
+from flacmanager.stats import RunStats, measure, measureIterator
+from flacmanager.transaction import TagTransaction, reservePadding
+from flacmanager.ui import (
+        LIST_PAGE_SIZE,
+        PagedListing,
+        console,
+        listSortKeys,
+        pageSize,
+        printMetadata,
+        )
+
+
+def buildParser():
+    parser = argparse.ArgumentParser(
+            prog="flacmanager",
+            description='Manages metadata for multiple audio formats.')
+    parser.add_argument("input",
+                        metavar="files",
+                        nargs="+",
+                        help='audio file(s)')
+    parser.add_argument("-d",
+                        "--directory",
+                        action="store_true",
+                        help='Takes directories as arguments.')
+    parser.add_argument("-l",
+                        "--list",
+                        action="store_true",
+                        default=False,
+                        help='Prints the metadata of the audio files.')
+    parser.add_argument("--list-sort",
+                        type=listSortKeys,
+                        default=[],
+                        metavar="KEYS",
+                        help='Sorts the listing by KEYS, separated by ";", '
+                             'among artist, album, genre, tracknumber, '
+                             'title and filename. The sorted listing is '
+                             'printed once every file is scanned.')
+    parser.add_argument("--page-size",
+                        type=pageSize,
+                        default=LIST_PAGE_SIZE,
+                        metavar="ROWS",
+                        help='Prints the listing ROWS files at a time, the '
+                             'first page as soon as its files are scanned.')
+    parser.add_argument("-r",
+                        "--rename",
+                        action="store_true",
+                        default=False,
+                        help='Renames files using tracknumber and title '
+                             'metadata.')
+    parser.add_argument("--name-template",
+                        type=nameTemplate,
+                        default=DEFAULT_NAME_TEMPLATE,
+                        metavar="TEMPLATE",
+                        help='File name used by --rename, made of tags such '
+                             'as "{tracknumber:02} - {title}".')
+    parser.add_argument("-s",
+                        "--sort",
+                        metavar="destination",
+                        nargs="?",
+                        help='Sorts audio files by artist and by album.')
+    parser.add_argument("--sort-mode",
+                        choices=SORT_MODES,
+                        default="move",
+                        help='How --sort places files: moved (copied then '
+                             'deleted across filesystems), copied, or '
+                             'hardlinked or reflinked so that no space is '
+                             'used twice.')
+    parser.add_argument("--transfer-jobs",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help='Copies files across filesystems with N '
+                             'concurrent transfers.')
+    parser.add_argument("-m",
+                        "--modify",
+                        nargs=2,
+                        metavar=('TAGS', 'VALUE'),
+                        help='Replaces all TAG values by VALUE')
+    parser.add_argument("--export",
+                        choices=EXPORT_FORMATS,
+                        help='Writes the path, size, stream info and every '
+                             'tag of each file as JSON Lines or CSV, as '
+                             'files are scanned.')
+    parser.add_argument("--export-file",
+                        metavar="FILE",
+                        help='Exports to FILE instead of the standard output.')
+    parser.add_argument("-p",
+                        "--picture",
+                        nargs=1,
+                        metavar="IMAGE",
+                        help="Adds IMAGE as cover art.")
+    parser.add_argument("--picture-size",
+                        type=int,
+                        metavar="PIXELS",
+                        help='Downsizes the cover art to fit in PIXELS and '
+                             'recompresses it as a JPEG. Needs Pillow, '
+                             'installed by pip install .[resize].')
+    parser.add_argument("--picture-quality",
+                        type=int,
+                        default=90,
+                        metavar="QUALITY",
+                        help='JPEG quality of a downsized cover art.')
+    parser.add_argument("--extract-art",
+                        action="store_true",
+                        help='Writes every distinct embedded picture once per '
+                             'directory as a sidecar file (cover.jpg, ...).')
+    parser.add_argument("--strip-art",
+                        action="store_true",
+                        help='Removes the embedded pictures once extracted '
+                             'by --extract-art.')
+    parser.add_argument("--dupes",
+                        action="store_true",
+                        help='Finds FLAC files holding the same audio, using '
+                             'the MD5 signature of their STREAMINFO block.')
+    parser.add_argument("--consistency",
+                        action="store_true",
+                        help='Reports the clusters of variant spellings of '
+                             'tag values across the library, such as "The '
+                             'Beatles" and "Beatles, The".')
+    parser.add_argument("--consistency-tags",
+                        default=CONSISTENCY_TAGS,
+                        metavar="TAGS",
+                        help='Tags checked by --consistency, separated by ; '
+                             f'(default: {CONSISTENCY_TAGS}).')
+    parser.add_argument("--consistency-edits",
+                        metavar="FILE",
+                        help='Writes the replacements of every variant by '
+                             'the canonical value of its cluster to FILE, '
+                             'as JSON Lines.')
+    parser.add_argument("--apply-edits",
+                        metavar="FILE",
+                        help='Replaces tag values as listed in FILE, as '
+                             'written by --consistency-edits.')
+    parser.add_argument("-i",
+                        "--interactive",
+                        action="store_true",
+                        default=False,
+                        help='Interactive mode.')
+    parser.add_argument("-f",
+                        "--filter",
+                        nargs=2,
+                        metavar=('TAGS', 'PATTERN'),
+                        help=(
+                            'Filters audio files using PATTERN on TAG values. '
+                            'Specify multiple tags by separating them with ;')
+                        )
+    parser.add_argument("-q",
+                        "--query",
+                        metavar="QUERY",
+                        help='Only keeps the files matching QUERY, e.g. '
+                             '\'artist~"^Bach" and genre=Classical and not '
+                             'title~live\'. Comparisons are =, !=, ~ and !~ '
+                             '(regex), <, <=, > and >= (on the leading '
+                             'number), "has TAG" and "missing TAG" check for '
+                             'a tag; combine them with and, or, not and '
+                             'parentheses.')
+    parser.add_argument("-o",
+                        "--order",
+                        action="store_true",
+                        help="Appends tracknumber to title.")
+    parser.add_argument("-D",
+                        "--delete",
+                        action="store_true",
+                        help='Deletes cover art and lyrics from the audio '
+                             'files.')
+    parser.add_argument("-F",
+                        "--format",
+                        action="store_true",
+                        help='Apply one, or several formatting presets.')
+    parser.add_argument("-R",
+                        "--regex",
+                        action="store_true",
+                        help='Multi-tag pattern matching and replace')
+    parser.add_argument("-j",
+                        "--jobs",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help='Parses files with N worker threads.')
+    parser.add_argument("--reindex",
+                        action="store_true",
+                        help='Re-parses every file and refreshes the metadata '
+                             'index.')
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help='Neither reads nor updates the metadata index.')
+    parser.add_argument("--sniff",
+                        action="store_true",
+                        help='With -d, also parses the files without an '
+                             'audio extension that start like an audio file.')
+    parser.add_argument("--shard",
+                        type=parseShard,
+                        metavar="K/N",
+                        help='Only processes the K-th of N disjoint shards of '
+                             'the files, so that N processes or hosts given '
+                             'the same arguments split the run. Files are '
+                             'assigned by a hash of their path relative to '
+                             'the directory argument they were found under. '
+                             'Shards on one host can share the cache '
+                             'directory; hosts sharing it over the network '
+                             'each need their own XDG_CACHE_HOME.')
+    parser.add_argument("--shard-by",
+                        choices=SHARD_MODES,
+                        default="album",
+                        help='Shards files by directory, keeping albums '
+                             'together (the default), or by path.')
+    # Files are streamed by default, the option is kept for the scripts
+    # written when it was needed.
+    parser.add_argument("--stream",
+                        action="store_true",
+                        help=argparse.SUPPRESS)
+    parser.add_argument("--reserve-padding",
+                        type=int,
+                        metavar="BYTES",
+                        help='Rewrites FLAC files once with BYTES of padding '
+                             'so that later tag edits are made in place.')
+    parser.add_argument("--in-place-only",
+                        action="store_true",
+                        help='Never rewrites a whole file, skips saves that '
+                             'do not fit in the existing padding. Otherwise '
+                             'full rewrites are only confirmed with -i, -R '
+                             'and -F.')
+    parser.add_argument("--write-jobs",
+                        type=int,
+                        default=1,
+                        metavar="N",
+                        help='Saves modified files with N concurrent writers.')
+    parser.add_argument("--no-journal",
+                        action="store_true",
+                        help='Does not journal the original tags, the run '
+                             'cannot be undone or resumed.')
+    parser.add_argument("--stats",
+                        action="store_true",
+                        help='Prints the time, file count and bytes read or '
+                             'written by every phase of the run.')
+    parser.add_argument("--stats-json",
+                        metavar="FILE",
+                        help='Writes the statistics of the run to FILE as '
+                             'JSON.')
+    parser.add_argument("--profile",
+                        metavar="FILE",
+                        help='Dumps cProfile statistics of the run to FILE.')
+    return parser
+
+
+def finishRun(stats, profiler, args):
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.stats:
+        stats.print()
+    if args.stats_json:
+        with open(args.stats_json, "w") as file:
+            json.dump(stats.summary(), file, indent=2)
+            file.write("\n")
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv[:1] == ["bench"]:
+        from flacmanager.bench import benchmarkMain
+        benchmarkMain(argv[1:])
+        return
+    if argv[:1] in (["undo"], ["resume"]):
+        journalMain(argv[0], argv[1:])
+        return
+    if argv[:1] == ["merge-stats"]:
+        from flacmanager.stats import mergeMain
+        mergeMain(argv[1:])
+        return
+    if argv[:1] == ["serve"]:
+        from flacmanager.server import serveMain
+        serveMain(argv[1:])
+        return
+    if argv[:1] == ["client"]:
+        from flacmanager.server import clientMain
+        clientMain(argv[1:])
+        return
+
+    args = buildParser().parse_args(argv)
+
+    stats = RunStats(f"{args.shard[0]}/{args.shard[1]}"
+                     if args.shard else None)
+    RunStats.active = stats
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    journal = None
+    if not args.no_journal:
+        journal = WriteJournal(argv)
+    exporter = None
+    if args.export:
+        exporter = openExporter(args.export, args.export_file)
+    try:
+        run(args, journal, exporter)
+        # An interrupted run keeps an unfinished journal to resume.
+        if journal is not None:
+            journal.close()
+    except BrokenPipeError:
+        # The reader of the export went away, as "| head" does: the run
+        # stops there and the rest of the output is dropped.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if exporter is not None:
+            exporter.close()
+        finishRun(stats, profiler, args)
+
+
+def run(args, journal=None, exporter=None):
+    query = None
+    if args.query:
+        try:
+            query = Query(args.query)
+        except QueryError as error:
+            console.print(f"[bold red]Invalid query: {error}[/]")
+            return
+    shard = None
+    if args.shard:
+        shard = Shard(*args.shard, args.shard_by)
+    edits = None
+    if args.apply_edits:
+        try:
+            edits = readEdits(args.apply_edits)
+        except (OSError, ValueError) as error:
+            console.print(f"[bold red]Invalid edits file: {error}[/]")
+            return
+
+    index = None
+    if not args.no_cache:
+        index = openMetadataIndex(args.reindex)
+
+    # Files are processed one at a time as they are found, unless a step
+    # needs all of them at once: the interactive pickers, the previews of
+    # -R and -F confirmed for the whole batch, and duplicate detection.
+    if (not args.interactive
+            and not args.regex
+            and not args.format
+            and not args.dupes):
+        reports = []
+        stages = streamStages(args, reports, edits)
+        errors = []
+        try:
+            if args.directory:
+                audio_files = iterAudioDirectories(args.input,
+                                                   True,
+                                                   index,
+                                                   args.jobs,
+                                                   errors,
+                                                   query,
+                                                   args.sniff,
+                                                   shard)
+            else:
+                audio_files = iterAudioFiles(args.input,
+                                             index,
+                                             args.jobs,
+                                             errors,
+                                             query,
+                                             shard)
+            audio_files = measureIterator("parse", audio_files)
+            with TagTransaction(padding=args.reserve_padding,
+                                in_place_only=args.in_place_only,
+                                write_jobs=args.write_jobs,
+                                journal=journal):
+                listing = None
+                if args.list:
+                    listing = PagedListing(sort_keys=args.list_sort,
+                                           page_size=args.page_size)
+                processed = streamAudioFiles(audio_files,
+                                             stages,
+                                             listing,
+                                             exporter)
+        finally:
+            if index is not None:
+                index.close()
+        reportReadErrors(errors)
+        for report in reports:
+            report.report()
+        if processed < 1:
+            console.print("No audio files were processed. Nothing to do.")
+        return
+
+    try:
+        if args.directory:
+            with console.status("Parsing directories..", spinner="line"), \
+                    measure("parse") as record:
+                audio_files = parseAudioDirectories(args.input,
+                                                    True,
+                                                    index,
+                                                    args.jobs,
+                                                    query,
+                                                    args.sniff,
+                                                    shard)
+        else:
+            with console.status("Parsing audio files..", spinner="line"), \
+                    measure("parse") as record:
+                audio_files = parseAudioFiles(args.input,
+                                              index,
+                                              args.jobs,
+                                              query,
+                                              shard)
+        record["files"] = len(audio_files)
+
+        if args.filter:
+            with measure("filter", len(audio_files)):
+                audio_files = filterAudioFiles(audio_files,
+                                               re.compile(args.filter[1]),
+                                               args.filter[0].split(";"))
+
+        if args.dupes:
+            with console.status("Reading audio signatures..",
+                                spinner="line"), \
+                    measure("dupes", len(audio_files)):
+                groups, unsigned = findDuplicates(audio_files, index)
+            printDuplicates(groups, unsigned)
+
+        # The index stays open while files are written, so that it is kept
+        # up to date with their new tags.
+        processAudioFiles(args, audio_files, edits, journal, exporter)
+    finally:
+        if index is not None:
+            index.close()
+
+
+def processAudioFiles(args, audio_files, edits=None, journal=None,
+                      exporter=None):
+    if args.interactive:
+        from flacmanager.interactive import interactiveMode
+        interactiveMode(audio_files, args.write_jobs, journal)
+    else:
+        with TagTransaction(audio_files,
+                            args.reserve_padding,
+                            args.in_place_only,
+                            True,
+                            args.write_jobs,
+                            journal):
+            if args.reserve_padding is not None:
+                with measure("padding", len(audio_files)):
+                    reservePadding(audio_files, args.reserve_padding)
+
+            if args.extract_art:
+                with measure("extract-art", len(audio_files)):
+                    extractArt(audio_files, args.strip_art)
+
+            if args.delete:
+                with measure("delete", len(audio_files)):
+                    deleteUselessTags(audio_files)
+
+            if args.rename:
+                with measure("rename", len(audio_files)):
+                    audio_files = renameAudioFiles(audio_files,
+                                                   args.name_template)
+
+            if args.order:
+                with measure("order", len(audio_files)):
+                    orderAudioFiles(audio_files)
+
+            if args.modify:
+                with measure("modify", len(audio_files)):
+                    modifyMetadata(audio_files,
+                                   False,
+                                   args.modify[0].split(";"),
+                                   r'^.*$',
+                                   args.modify[1])
+
+            if args.regex:
+                with measure("regex", len(audio_files)):
+                    modifyMetadata(audio_files,
+                                   False,
+                                   [],
+                                   None,
+                                   None)
+
+            if args.format:
+                with measure("format", len(audio_files)):
+                    applyPresets(audio_files, None)
+
+            if edits is not None:
+                with measure("apply-edits", len(audio_files)):
+                    applyEditFile(audio_files, edits)
+
+            if args.picture:
+                with measure("picture", len(audio_files)):
+                    addPicture(args.picture[0],
+                               audio_files,
+                               args.picture_size,
+                               args.picture_quality)
+
+            if args.sort:
+                with measure("sort", len(audio_files)):
+                    base_path = args.sort if os.path.isdir(args.sort) else ""
+                    audio_files = sortAudioFiles(audio_files,
+                                                 base_path,
+                                                 args.sort_mode,
+                                                 args.transfer_jobs)
+
+        if args.list:
+            with console.status("Printing metadata..", spinner="line"), \
+                    measure("list", len(audio_files)):
+                printMetadata(audio_files,
+                              sort_keys=args.list_sort,
+                              page_size=args.page_size)
+
+        if exporter is not None:
+            with console.status("Exporting metadata..", spinner="line"), \
+                    measure("export", len(audio_files)):
+                exportMetadata(audio_files, exporter)
+
+        if args.consistency:
+            with console.status("Clustering tag values..", spinner="line"), \
+                    measure("consistency", len(audio_files)):
+                consistencyReport(audio_files,
+                                  args.consistency_tags.split(";"),
+                                  args.consistency_edits)
@@ -0,0 +1,236 @@
+import json
+import re
+import unicodedata
+
+from collections import Counter
+from difflib import SequenceMatcher
+
+from flacmanager.transaction import saveAudio
+from flacmanager.ui import console
+
+
+CONSISTENCY_TAGS = "artist;album;genre"
+# Only English articles: "De Staat" or "I Monster" are not "Staat" or
+# "Monster".
+ARTICLES = ("the", "a", "an")
+SIMILARITY_THRESHOLD = 0.85
+# Keys shorter than this are only grouped when they are equal, since a
+# single letter is already a large part of them.
+MIN_FUZZY_LENGTH = 5
+# Number of sorted keys each key is compared with.
+NEIGHBOURHOOD = 8
+
+
+def normalizeValue(value):
+    # "The Beatles", "Beatles, The" and "the  beatles " all become
+    # "beatles": accents, case, punctuation and leading articles aside.
+    value = unicodedata.normalize("NFKD", value)
+    value = "".join(character for character in value
+                    if not unicodedata.combining(character)).casefold()
+    value = value.replace("&", " and ")
+    value = re.sub(r"[^\w\s,]", " ", value)
+    match = re.fullmatch(r"(.*),\s*(\w+)\s*", value)
+    if match is not None and match.group(2) in ARTICLES:
+        value = f"{match.group(2)} {match.group(1)}"
+    words = value.replace(",", " ").split()
+    if len(words) > 1 and words[0] in ARTICLES:
+        words = words[1:]
+    return " ".join(words)
+
+
+def similarKeys(first, second, threshold=SIMILARITY_THRESHOLD):
+    # "Vol. 1" and "Vol. 2" are different records however close they look.
+    if re.findall(r"\d+", first) != re.findall(r"\d+", second):
+        return False
+    if (min(len(first), len(second))
+            < threshold * max(len(first), len(second))):
+        return False
+    matcher = SequenceMatcher(None, first, second)
+    return (matcher.quick_ratio() >= threshold
+            and matcher.ratio() >= threshold)
+
+
+def neighbourPairs(keys, window=NEIGHBOURHOOD):
+    # Pairs every key with the next ones in alphabetical order, and again
+    # in the order of the reversed keys, so that a typo is only missed when
+    # both ends of a value differ.
+    numbers = range(len(keys))
+    for order in (sorted(numbers, key=keys.__getitem__),
+                  sorted(numbers, key=lambda number: keys[number][::-1])):
+        for position, number in enumerate(order):
+            for other in order[position + 1:position + window]:
+                yield number, other
+
+
+def clusterValues(counts, threshold=SIMILARITY_THRESHOLD):
+    # Groups the values of counts sharing a normalization key, then joins
+    # the groups whose keys are close. Keys are only compared with their
+    # neighbours once sorted, so that the work grows with the number of
+    # values rather than with its square.
+    groups = {}
+    for value in counts:
+        key = normalizeValue(value)
+        if key:
+            groups.setdefault(key, []).append(value)
+    keys = list(groups)
+    parents = list(range(len(keys)))
+
+    def root(number):
+        while parents[number] != number:
+            parents[number] = parents[parents[number]]
+            number = parents[number]
+        return number
+
+    for number, other in neighbourPairs(keys):
+        if (len(keys[number]) >= MIN_FUZZY_LENGTH
+                and len(keys[other]) >= MIN_FUZZY_LENGTH
+                and root(number) != root(other)
+                and similarKeys(keys[number], keys[other], threshold)):
+            parents[root(number)] = root(other)
+    clusters = {}
+    for number, key in enumerate(keys):
+        clusters.setdefault(root(number), []).extend(groups[key])
+    return [values for values in clusters.values() if len(values) > 1]
+
+
+def canonicalValue(values, counts):
+    # The spelling used by most tracks, preferring trimmed and capitalized
+    # values on a tie.
+    return min(values, key=lambda value: (-counts[value],
+                                          value != value.strip(),
+                                          value == value.lower(),
+                                          value))
+
+
+class ConsistencyReport:
+    # Counts the values of target_tags across the library, one file at a
+    # time, and reports the clusters of variant spellings at the end.
+    def __init__(self, target_tags, edits_path=None):
+        self.counts = {tag: Counter() for tag in target_tags}
+        self.edits_path = edits_path
+
+    def add(self, audio, path):
+        for tag, counts in self.counts.items():
+            for value in audio.tags.get(tag) or ():
+                if str(value).strip():
+                    counts[str(value)] += 1
+        return path
+
+    def clusters(self):
+        # Returns (tag, canonical value, [(value, tracks)..]) for every
+        # cluster, the most used ones first.
+        clusters = []
+        for tag, counts in self.counts.items():
+            for values in clusterValues(counts):
+                canonical = canonicalValue(values, counts)
+                values = sorted(values, key=lambda value: (-counts[value],
+                                                           value))
+                clusters.append((tag,
+                                 canonical,
+                                 [(value, counts[value]) for value in values]))
+        clusters.sort(key=lambda cluster: (-sum(tracks for value, tracks
+                                                in cluster[2]),
+                                           cluster[0],
+                                           cluster[1]))
+        return clusters
+
+    def report(self):
+        from rich import box
+        from rich.markup import escape
+        from rich.table import Table
+
+        clusters = self.clusters()
+        for tag, canonical, values in clusters:
+            table = Table(title=f"{tag.capitalize()} : {escape(canonical)}",
+                          title_justify="left",
+                          box=box.MINIMAL_HEAVY_HEAD)
+            table.add_column("Value", no_wrap=True, max_width=60)
+            table.add_column("Tracks", no_wrap=True, justify="right")
+            for value, tracks in values:
+                label = escape(repr(value) if value != value.strip()
+                               else value)
+                if value == canonical:
+                    label = f"[bold green]{label}[/]"
+                table.add_row(label, str(tracks))
+            console.print(table)
+        edits = [tracks
+                 for tag, canonical, values in clusters
+                 for value, tracks in values
+                 if value != canonical]
+        console.print(f"{len(clusters)} cluster(s) of variant spellings, "
+                      f"{len(edits)} value(s) to replace in {sum(edits)} "
+                      f"track(s).")
+        if self.edits_path is not None:
+            writeEdits(self.edits_path, clusters)
+            console.print(f"Edits written to {self.edits_path}, apply them "
+                          f"with --apply-edits once reviewed.")
+
+
+def writeEdits(path, clusters):
+    # One JSON object per line, {"tag", "from", "to", "tracks"}, meant to
+    # be reviewed and edited by hand before being applied.
+    with open(path, "w", encoding="utf-8") as file:
+        for tag, canonical, values in clusters:
+            for value, tracks in values:
+                if value != canonical:
+                    file.write(json.dumps({"tag": tag,
+                                           "from": value,
+                                           "to": canonical,
+                                           "tracks": tracks},
+                                          ensure_ascii=False) + "\n")
+
+
+def readEdits(path):
+    # Returns {tag: {value: replacement}}. Raises ValueError on a line
+    # that is not an edit.
+    edits = {}
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                edit = json.loads(line)
+                tag = edit["tag"].lower()
+                edits.setdefault(tag, {})[edit["from"]] = str(edit["to"])
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(f"line {number} is not a "
+                                 f'{{"tag", "from", "to"}} edit') from None
+    return edits
+
+
+def applyEdits(audio, edits):
+    changed = False
+    for tag, replacements in edits.items():
+        values = audio.tags.get(tag)
+        if not values:
+            continue
+        replaced = [replacements.get(str(value), value) for value in values]
+        if replaced != list(values):
+            audio.tags[tag] = replaced
+            changed = True
+    if changed:
+        saveAudio(audio)
+    return changed
+
+
+def applyEditFile(audio_files, edits):
+    from rich.prompt import Confirm
+
+    pending = [audio for audio, path in audio_files
+               if any(str(value) in replacements
+                      for tag, replacements in edits.items()
+                      for value in audio.tags.get(tag) or ())]
+    if not pending:
+        console.print("No file holds a value to replace.")
+        return
+    if Confirm.ask(f"{len(pending)} file(s) hold values to replace. "
+                   f"Proceed?"):
+        for audio in pending:
+            applyEdits(audio, edits)
+
+
+def consistencyReport(audio_files, target_tags, edits_path=None):
+    report = ConsistencyReport(target_tags, edits_path)
+    for audio, path in audio_files:
+        report.add(audio, path)
+    report.report()
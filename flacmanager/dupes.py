@@ -0,0 +1,91 @@
+import os
+
+from flacmanager.audio import audioKind, readFlacStreamInfo, snapshotTags
+from flacmanager.stats import recordIO
+from flacmanager.ui import console
+
+
+UNSET_MD5 = "0" * 32
+
+
+def audioSignature(path, index=None):
+    # The MD5 of the decoded audio along with the stream parameters, so
+    # that the same rip matches whatever its tags, padding or pictures.
+    stat = os.stat(path)
+    if index is not None:
+        signature = index.lookupSignature(path, stat)
+        if signature is not None:
+            return signature or None
+    sample_rate, channels, bits, samples, md5 = readFlacStreamInfo(path)
+    recordIO(bytes_read=42)
+    signature = ""
+    if md5 != UNSET_MD5:
+        signature = f"{md5}:{sample_rate}:{channels}:{bits}:{samples}"
+    if index is not None:
+        index.storeSignature(path, stat, signature)
+    return signature or None
+
+
+def findDuplicates(audio_files, index=None):
+    # Returns the groups of files sharing a signature, along with the
+    # number of FLAC files whose encoder did not store the MD5.
+    signatures = {}
+    unsigned = 0
+    errors = []
+    for audio, path in audio_files:
+        if audioKind(audio) != "FLAC":
+            continue
+        try:
+            signature = audioSignature(path, index)
+        except (OSError, ValueError) as error:
+            errors.append((path, error))
+            continue
+        if signature is None:
+            unsigned += 1
+            continue
+        signatures.setdefault(signature, []).append((audio, path))
+    for path, error in errors:
+        console.print(f"[bold red]Could not read {path} : {error}[/]")
+    groups = [group for group in signatures.values() if len(group) > 1]
+    return groups, unsigned
+
+
+def tagDifferences(group):
+    snapshots = [snapshotTags(audio) for audio, path in group]
+    keys = []
+    for snapshot in snapshots:
+        for key in snapshot:
+            if key not in keys:
+                keys.append(key)
+    return [key for key in keys
+            if any(snapshot.get(key) != snapshots[0].get(key)
+                   for snapshot in snapshots)]
+
+
+def printDuplicates(groups, unsigned=0):
+    from rich import box
+    from rich.table import Table
+
+    extra_bytes = 0
+    for number, group in enumerate(groups, 1):
+        differences = tagDifferences(group)
+        table = Table(title=f"Duplicate group {number}",
+                      title_justify="left",
+                      box=box.MINIMAL_HEAVY_HEAD)
+        table.add_column("File", no_wrap=True, max_width=60)
+        for key in differences:
+            table.add_column(key.capitalize(), no_wrap=True, max_width=30)
+        for audio, path in group:
+            table.add_row(str(path),
+                          *("; ".join(audio.tags.get(key, []))
+                            for key in differences))
+        console.print(table)
+        if not differences:
+            console.print("[dim italic]Every copy has the same tags.[/]")
+        extra_bytes += sum(os.path.getsize(path) for audio, path in group[1:])
+    console.print(f"{len(groups)} group(s) of duplicates, "
+                  f"{sum(len(group) - 1 for group in groups)} extra "
+                  f"copies ({extra_bytes / 1048576:.1f} MiB).")
+    if unsigned:
+        console.print(f"[bold yellow]{unsigned} file(s) have no audio MD5 "
+                      f"and could not be compared.[/]")
@@ -0,0 +1,243 @@
+import re
+
+from flacmanager.audio import firstValue
+from flacmanager.transaction import saveAudio
+from flacmanager.ui import console, printMetadata, printPreview
+
+
+def matchesFilter(audio, regex, target_tags):
+    pattern = re.compile(regex)
+    for tag in target_tags:
+        value = firstValue(audio, tag)
+        if value is not None and pattern.search(value):
+            return True
+    return False
+
+
+def filterAudioFiles(audio_files,
+                     regex=r'',
+                     target_tags=("artist",
+                                  "album",
+                                  "genre",
+                                  "tracknumber",
+                                  "title")):
+    if not target_tags:
+        from flacmanager.selection import radioSelection
+
+        target_tags = radioSelection("Select tags you wish to filter on",
+                                     ("artist",
+                                      "album",
+                                      "genre",
+                                      "tracknumber",
+                                      "title"))
+    pattern = re.compile(regex)
+    result = [(audio, path) for audio, path in audio_files
+              if matchesFilter(audio, pattern, target_tags)]
+    if len(result) < 1:
+        console.print('[bold red]Filter returned an empty argument list.[/]')
+    return result
+
+
+class RegexRule:
+    # A pattern compiled once and matched with a single subn() per tag
+    # value, so the preview shown to the user is the change-set applied.
+    def __init__(self, regex, target_tags, replace=""):
+        self.pattern = re.compile(regex)
+        self.target_tags = tuple(target_tags)
+        self.replace = replace
+
+    def matches(self, audio):
+        return matchesFilter(audio, self.pattern, self.target_tags)
+
+    def changes(self, audio):
+        changes = {}
+        for tag in self.target_tags:
+            old_value = firstValue(audio, tag)
+            if old_value is None:
+                continue
+            new_value, count = self.pattern.subn(self.replace, old_value)
+            if count:
+                changes[tag] = {"old": old_value, "new": new_value}
+        return changes
+
+
+def previewRule(rule, audio_files):
+    preview = []
+    for audio, path in audio_files:
+        changes = rule.changes(audio)
+        if changes:
+            preview.append({"audio": audio, "path": path, "changes": changes})
+    return preview
+
+
+def applyChanges(audio, changes):
+    for tag, values in changes.items():
+        audio.tags[tag] = values["new"]
+    saveAudio(audio)
+
+
+def applyPreview(preview):
+    for file_preview in preview:
+        applyChanges(file_preview["audio"], file_preview["changes"])
+
+
+def applyRegex(audio_files,
+               regex,
+               target_tags=("artist",
+                            "album",
+                            "genre",
+                            "tracknumber",
+                            "title"),
+               replace="",
+               dry_run=True):
+    preview = previewRule(RegexRule(regex, target_tags, replace),
+                          audio_files)
+    if dry_run:
+        return preview
+    applyPreview(preview)
+    return list(audio_files)
+
+
+def modifyMetadata(audio_files,
+                   dry_run=True,
+                   target_tags=("artist",
+                                "album",
+                                "genre",
+                                "tracknumber",
+                                "title"),
+                   regex=None,
+                   replace=None,
+                   assume_yes=False,
+                   ):
+    from rich.prompt import Confirm, Prompt
+
+    if len(target_tags) < 1:
+        from flacmanager.selection import radioSelection
+
+        target_tags = radioSelection("Select tags to apply modifications to",
+                                     ("artist",
+                                      "album",
+                                      "genre",
+                                      "tracknumber",
+                                      "title"))
+    if regex is None:
+        regex = Prompt.ask("Pattern to match", default="^.*$")
+    rule = RegexRule(regex, target_tags)
+    filter_result = filterAudioFiles(audio_files, rule.pattern, target_tags)
+    if len(filter_result) > 0:
+        printMetadata(filter_result, rule.pattern, target_tags, "bold green")
+    else:
+        return
+    if replace is None:
+        replace = Prompt.ask("Replace by")
+    rule.replace = replace
+    preview = previewRule(rule, filter_result)
+    printPreview(preview)
+    choice = assume_yes or Confirm.ask("Proceed?")
+    if choice:
+        applyPreview(preview)
+
+
+PRESETS = {
+    'A': (("artist",
+           "genre"),
+          re.compile(r'([^,;]+)[,;].*'),
+          r'\1'),
+    'C': (("album",
+           "artist",
+           "genre",
+           "title"),
+          re.compile(r'\b\w+\b'),
+          lambda m: m.group(0)
+          if m.group(0) == m.group(0).title()
+          else m.group(0).title()),
+    'P': (("artist",
+           "album",
+           "genre",
+           "title"),
+          re.compile(r'\s*\([^()]*\)\s*'),
+          ''),
+    'W': (("artist",
+           "album",
+           "genre",
+           "tracknumber",
+           "title"),
+          re.compile(r'[\/\0\*\?\[\]\{\}~!$&;|<>"\'`\\]'),
+          ''),
+    'Z': (["tracknumber"],
+          re.compile(r'\b(\d)\b'),
+          r'0\1'),
+}
+
+
+def printPresets():
+    console.print('''
+------------------------------------
+    A - Only keep the first artist/genre.
+    C - Capitalizes every word in the title tag.
+    P - Removes everything under parentheses.
+    W - Removes wildcards characters.
+    Z - Zeropadding of every single-digit tracknumber.
+------------------------------------
+                  ''')
+
+
+def applyPresets(audio_files, presets=None, assume_yes=False):
+    printPresets()
+    if presets is None:
+        from flacmanager.selection import radioSelection
+
+        presets = radioSelection("Select a formatting preset",
+                                 tuple(PRESETS))
+    for preset in presets:
+        if preset in PRESETS:
+            target_tags, regex, replace = PRESETS[preset]
+            modifyMetadata(audio_files,
+                           False,
+                           target_tags,
+                           regex,
+                           replace,
+                           assume_yes)
+
+
+def orderAudioFile(audio, path):
+    if "tracknumber" in audio.tags and "title" in audio.tags:
+        new_title = (
+                f"{audio.tags['tracknumber'][0]}"
+                f" - {audio.tags['title'][0]}"
+                )
+        audio.tags['title'] = new_title
+        return True
+    console.print(f"Could not rename {path.name} : missing tags.")
+    return False
+
+
+def orderAudioFiles(audio_files):
+    for audio, path in audio_files:
+        if orderAudioFile(audio, path):
+            saveAudio(audio)
+
+
+def stripAudioFile(audio):
+    tags = ("artist", "album", "genre", "tracknumber", "title")
+    for key, value in audio.tags.items():
+        if key not in tags:
+            del audio.tags[key]
+    had_pictures = bool(getattr(audio, "pictures", ()))
+    audio.clear_pictures()
+    return had_pictures
+
+
+def deleteUselessTags(audio_files):
+    from rich.prompt import Confirm
+
+    choice = Confirm.ask(f"This will remove ALL tags and cover art except: "
+                         f"artist, album, genre, tracknumber, title "
+                         f"from {len(audio_files)} files. Proceed?")
+    if choice:
+        with console.status("Deleting cover art and useless tags..",
+                            spinner="line"):
+            for audio, path in audio_files:
+                saveAudio(audio, stripAudioFile(audio))
+    else:
+        console.print("No modifications have been made.")
@@ -0,0 +1,124 @@
+import csv
+import json
+import os
+import sys
+
+from flacmanager.audio import (
+        LazyAudio,
+        audioKind,
+        readFlacStreamInfo,
+        snapshotTags,
+        )
+from flacmanager.stats import recordIO
+from flacmanager.ui import console
+
+
+EXPORT_FORMATS = ("jsonl", "csv")
+CSV_TAGS = ("artist", "album", "genre", "tracknumber", "title")
+STREAM_FIELDS = ("sample_rate", "channels", "bits_per_sample",
+                 "total_samples", "md5")
+
+
+def streamInfo(audio):
+    if audioKind(audio) == "FLAC":
+        try:
+            info = readFlacStreamInfo(audio.filename)
+        except (OSError, ValueError):
+            return {}
+        recordIO(bytes_read=42)
+        return dict(zip(STREAM_FIELDS, info))
+    if isinstance(audio, LazyAudio):
+        # Only the tags of the file are held, its stream info is read
+        # again without keeping the mutagen object.
+        if audio.audio is None:
+            import mutagen
+            from mutagen import MutagenError
+
+            try:
+                info = getattr(mutagen.File(audio.filename), "info", None)
+            except (MutagenError, OSError):
+                return {}
+        else:
+            info = getattr(audio.audio, "info", None)
+    else:
+        info = getattr(audio, "info", None)
+    if info is None:
+        return {}
+    sample_rate = getattr(info, "sample_rate", None)
+    length = getattr(info, "length", None)
+    return {"sample_rate": sample_rate,
+            "channels": getattr(info, "channels", None),
+            "bits_per_sample": getattr(info, "bits_per_sample", None),
+            "total_samples": round(sample_rate * length)
+            if sample_rate and length else None,
+            "md5": None}
+
+
+def exportRecord(audio, path):
+    try:
+        size = os.path.getsize(audio.filename)
+    except OSError:
+        size = None
+    return {"path": str(path),
+            "size": size,
+            "kind": audioKind(audio),
+            "streaminfo": streamInfo(audio),
+            "tags": snapshotTags(audio)}
+
+
+class MetadataExporter:
+    # Writes one record per file as soon as it is handed over, flushing
+    # every batch_size records so that a pipe sees them during the scan.
+    def __init__(self, format, file, batch_size=100):
+        self.format = format
+        self.file = file
+        self.batch_size = batch_size
+        self.count = 0
+        self.writer = None
+        if format == "csv":
+            self.writer = csv.writer(file)
+            self.writer.writerow(("path", "size", "kind")
+                                 + STREAM_FIELDS
+                                 + CSV_TAGS
+                                 + ("tags",))
+
+    def write(self, audio, path):
+        record = exportRecord(audio, path)
+        if self.writer is None:
+            self.file.write(json.dumps(record,
+                                       ensure_ascii=False,
+                                       default=str) + "\n")
+        else:
+            tags = record["tags"]
+            self.writer.writerow(
+                    (record["path"], record["size"], record["kind"])
+                    + tuple(record["streaminfo"].get(field)
+                            for field in STREAM_FIELDS)
+                    + tuple("; ".join(map(str, tags.get(tag, [])))
+                            for tag in CSV_TAGS)
+                    + (json.dumps(tags, ensure_ascii=False, default=str),))
+        self.count += 1
+        if self.count % self.batch_size == 0:
+            self.file.flush()
+
+    def close(self):
+        self.file.flush()
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def openExporter(format, destination=None):
+    # Exporting to the standard output moves every message to the
+    # standard error, keeping the output parseable.
+    if destination in (None, "-"):
+        console.configure(stderr=True)
+        return MetadataExporter(format, sys.stdout)
+    return MetadataExporter(format, open(destination,
+                                         "w",
+                                         encoding="utf-8",
+                                         newline=""))
+
+
+def exportMetadata(audio_files, exporter):
+    for audio, path in audio_files:
+        exporter.write(audio, path)
@@ -0,0 +1,440 @@
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import string
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from flacmanager.stats import recordIO
+from flacmanager.transaction import TagTransaction
+from flacmanager.ui import console
+
+
+SORT_MODES = ("move", "copy", "hardlink", "reflink")
+FICLONE = 0x40049409
+INVALID_CHARACTERS = re.compile(r'[<>:"/\\|?*\x00-\x1f]' if os.name == "nt"
+                                else r'[/\x00]')
+
+
+def relocateAudio(audio, destination):
+    # Keeps later saves pointed at the file's new location.
+    audio.filename = str(destination)
+
+
+def sanitizeComponent(name, default):
+    # Keeps a tag value usable as a single path component.
+    name = INVALID_CHARACTERS.sub("_", name).strip()
+    if os.name == "nt":
+        name = name.rstrip(". ")
+    if name in ("", ".", ".."):
+        return default
+    return name
+
+
+def copyVerified(source, destination):
+    # Streams the file to its destination while hashing it, then reads the
+    # copy back and compares, so a failed transfer never loses the source.
+    digest = hashlib.sha1()
+    size = 0
+    with open(source, "rb") as reader, open(destination, "xb") as writer:
+        while True:
+            chunk = reader.read(1048576)
+            if not chunk:
+                break
+            digest.update(chunk)
+            writer.write(chunk)
+            size += len(chunk)
+        writer.flush()
+        os.fsync(writer.fileno())
+    check = hashlib.sha1()
+    with open(destination, "rb") as reader:
+        while True:
+            chunk = reader.read(1048576)
+            if not chunk:
+                break
+            check.update(chunk)
+    if check.digest() != digest.digest():
+        os.unlink(destination)
+        raise OSError(f"{destination} does not match {source} after copy")
+    shutil.copystat(source, destination)
+    return size
+
+
+def reflink(source, destination):
+    import fcntl
+
+    with open(source, "rb") as reader, open(destination, "xb") as writer:
+        try:
+            fcntl.ioctl(writer.fileno(), FICLONE, reader.fileno())
+        except OSError:
+            writer.close()
+            os.unlink(destination)
+            raise
+    shutil.copystat(source, destination)
+
+
+class SortPlanner:
+    # Computes where every file goes before anything is touched: each
+    # directory is created once, collisions are reported instead of
+    # overwriting, and moves across filesystems become verified copies.
+    def __init__(self, base_path="", mode="move", jobs=1):
+        self.base_path = Path(base_path).resolve()
+        self.mode = mode
+        self.jobs = max(jobs, 1)
+        self.directories = {}
+        self.claimed = set()
+        self.renamed = 0
+        self.copied = 0
+        self.copied_bytes = 0
+        self.linked = 0
+        self.unchanged = 0
+        self.errors = []
+        self.deferred = []
+
+    def destination(self, audio, path):
+        artist = audio.tags.get("artist", ["Unknown Artist"])[0]
+        album = audio.tags.get("album", ["Unknown Album"])[0]
+        return (self.base_path
+                / sanitizeComponent(artist, "Unknown Artist")
+                / sanitizeComponent(album, "Unknown Album")
+                / Path(path).name)
+
+    def plan(self, audio_files):
+        # Returns (audio, source, destination) for every file to transfer;
+        # files already in place are returned with destination None.
+        moves = []
+        for audio, path in audio_files:
+            source = Path(path).resolve()
+            destination = self.destination(audio, source)
+            if destination == source:
+                self.unchanged += 1
+                moves.append((audio, source, None))
+                continue
+            if destination in self.claimed or os.path.lexists(destination):
+                self.errors.append((source,
+                                    f"{destination} already exists."))
+                moves.append((audio, source, None))
+                continue
+            self.claimed.add(destination)
+            moves.append((audio, source, destination))
+        return moves
+
+    def prepare(self, directory):
+        # Returns the device of the directory, creating it the first time.
+        device = self.directories.get(directory)
+        if device is None:
+            directory.mkdir(parents=True, exist_ok=True)
+            device = os.stat(directory).st_dev
+            self.directories[directory] = device
+        return device
+
+    def transfer(self, source, destination, device):
+        # Runs on the transfer pool. Returns the kind of transfer made.
+        if self.mode == "hardlink":
+            os.link(source, destination)
+            return "link", 0
+        if self.mode == "reflink":
+            reflink(source, destination)
+            return "link", 0
+        if self.mode == "move" and os.stat(source).st_dev == device:
+            os.rename(source, destination)
+            return "rename", 0
+        size = copyVerified(source, destination)
+        if self.mode == "move":
+            os.unlink(source)
+        return "copy", size
+
+    def run(self, moves):
+        transfers = []
+        for audio, source, destination in moves:
+            if destination is None:
+                continue
+            try:
+                device = self.prepare(destination.parent)
+            except OSError as error:
+                self.errors.append((source, error))
+                continue
+            transfers.append((audio, source, destination, device))
+
+        def attempt(transfer):
+            audio, source, destination, device = transfer
+            try:
+                return self.transfer(source, destination, device), None
+            except OSError as error:
+                return None, error
+
+        if self.jobs > 1 and len(transfers) > 1:
+            with ThreadPoolExecutor(min(self.jobs,
+                                        len(transfers))) as executor:
+                outcomes = list(executor.map(attempt, transfers))
+        else:
+            outcomes = map(attempt, transfers)
+        moved = {}
+        for (audio, source, destination, device), (outcome, error) in zip(
+                transfers, outcomes):
+            if error is not None:
+                self.claimed.discard(destination)
+                self.errors.append((source, error))
+                continue
+            kind, size = outcome
+            if kind == "rename":
+                self.renamed += 1
+            elif kind == "copy":
+                self.copied += 1
+                self.copied_bytes += size
+                recordIO(bytes_read=size * 2, bytes_written=size)
+            else:
+                self.linked += 1
+            relocateAudio(audio, destination)
+            moved[id(audio)] = destination
+        return [(audio, moved.get(id(audio), source))
+                for audio, source, destination in moves]
+
+    def sortStage(self, audio, path):
+        # Streamed files are transferred jobs * 4 at a time by the pool,
+        # once their tags are saved: each batch goes before the next file
+        # is planned, since the files before it have been committed by
+        # then, and the last one in report().
+        if len(self.deferred) >= self.jobs * 4:
+            self.transferDeferred()
+        audio, source, destination = self.plan([(audio, path)])[0]
+        if destination is None:
+            return source
+        self.deferred.append((audio, source, destination))
+        return destination
+
+    def transferDeferred(self):
+        moves, self.deferred = self.deferred, []
+        if not moves:
+            return
+        transaction = TagTransaction.active
+        if transaction is not None:
+            transaction.flushPending()
+        self.run(moves)
+
+    def report(self):
+        self.transferDeferred()
+        console.print(f"Sorted {self.renamed + self.copied + self.linked} "
+                      f"file(s): {self.renamed} renamed, {self.copied} "
+                      f"copied ({self.copied_bytes / 1048576:.1f} MiB), "
+                      f"{self.linked} linked, {self.unchanged} already "
+                      f"in place.")
+        if self.errors:
+            console.print(f"[bold red]Could not sort {len(self.errors)} "
+                          f"file(s):[/]")
+            for path, error in self.errors:
+                console.print(f"  {path} : {error}")
+
+
+def sortAudioFiles(audio_files, base_path="", mode="move", jobs=1):
+    planner = SortPlanner(base_path, mode, jobs)
+    with console.status("Planning moves..", spinner="line"):
+        moves = planner.plan(audio_files)
+    with console.status("Sorting audio files..", spinner="line"):
+        result = planner.run(moves)
+    planner.report()
+    return result
+
+
+DEFAULT_NAME_TEMPLATE = "{tracknumber} - {title}"
+
+
+def nameTemplate(text):
+    # Only plain tag names are allowed in fields, with an optional format
+    # spec: no attribute or index lookups, conversions or nested fields.
+    try:
+        fields = list(string.Formatter().parse(text))
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+                f"invalid name template {text!r}: {error}") from None
+    for literal, field, spec, conversion in fields:
+        if field is None:
+            continue
+        if not re.fullmatch(r"\w+", field) or conversion or "{" in spec:
+            if conversion:
+                field = f"{field}!{conversion}"
+            raise argparse.ArgumentTypeError(
+                    f"invalid field {{{field}}} in name template {text!r}, "
+                    f"expected a tag name such as {{title}} or "
+                    f"{{tracknumber:02}}")
+    return text
+
+
+class NameFormatter(string.Formatter):
+    # Fills a template with the first value of each tag. A format spec
+    # applies to the leading number of the value, so that {tracknumber:02}
+    # works with "3" as well as "3/12".
+    def get_field(self, field_name, args, kwargs):
+        if not re.fullmatch(r"\w+", field_name):
+            raise ValueError(f"unsupported template field {{{field_name}}}")
+        return self.get_value(field_name, args, kwargs), field_name
+
+    def get_value(self, key, args, kwargs):
+        values = kwargs["tags"].get(str(key).lower())
+        if not values:
+            raise KeyError(key)
+        return values[0]
+
+    def format_field(self, value, format_spec):
+        if format_spec:
+            number = re.match(r"\s*(\d+)", value)
+            try:
+                if number is not None:
+                    value = format(int(number.group(1)), format_spec)
+                else:
+                    value = format(value, format_spec)
+            except ValueError:
+                pass
+        return INVALID_CHARACTERS.sub("_", str(value))
+
+
+class RenamePlanner:
+    # Computes every new name before renaming anything. Each directory is
+    # listed once; names taken by files that stay, or by an earlier file of
+    # the batch, get a " (2)", " (3)".. suffix in path order. Renames onto
+    # a name another file is leaving go through a temporary name so that
+    # swaps and cycles never overwrite anything.
+    def __init__(self, template=DEFAULT_NAME_TEMPLATE):
+        self.template = template
+        self.formatter = NameFormatter()
+        self.listings = {}
+        self.renamed = 0
+        self.unchanged = 0
+        self.errors = []
+
+    def name(self, audio, path):
+        name = self.formatter.format(self.template, tags=audio.tags)
+        name = sanitizeComponent(name, "")
+        if not name:
+            raise KeyError(self.template)
+        return name + path.suffix
+
+    def listing(self, directory):
+        names = self.listings.get(directory)
+        if names is None:
+            names = set(os.listdir(directory))
+            self.listings[directory] = names
+        return names
+
+    def plan(self, audio_files):
+        # Returns (audio, source, destination) sorted by source path.
+        targets = []
+        for audio, path in audio_files:
+            path = Path(path)
+            try:
+                targets.append((audio, path, self.name(audio, path)))
+            except (KeyError, IndexError):
+                self.errors.append((path, "missing tags."))
+            except ValueError as error:
+                self.errors.append((path, error))
+        targets.sort(key=lambda target: str(target[1]))
+        # Files keeping their name hold it before any other file of the
+        # batch is given a name.
+        leaving = {}
+        claimed = {}
+        for audio, path, name in targets:
+            if name == path.name:
+                claimed.setdefault(path.parent, set()).add(name)
+            else:
+                leaving.setdefault(path.parent, set()).add(path.name)
+        moves = []
+        for audio, path, name in targets:
+            directory = path.parent
+            try:
+                taken = self.listing(directory)
+            except OSError as error:
+                self.errors.append((path, error))
+                continue
+            if name == path.name:
+                moves.append((audio, path, path))
+                continue
+            names = claimed.setdefault(directory, set())
+            stem, suffix = os.path.splitext(name)
+            candidate = name
+            number = 1
+            while (candidate in names
+                   or (candidate in taken
+                       and candidate not in leaving.get(directory, ()))):
+                number += 1
+                candidate = f"{stem} ({number}){suffix}"
+            names.add(candidate)
+            moves.append((audio, path, directory / candidate))
+        return moves
+
+    def rename(self, audio, source, destination):
+        names = self.listings.get(source.parent)
+        if os.path.lexists(destination):
+            raise FileExistsError(f"{destination} already exists.")
+        os.rename(source, destination)
+        if names is not None:
+            names.discard(source.name)
+            names.add(destination.name)
+
+    def run(self, moves):
+        # First pass: renames onto free names, and files whose target is
+        # still taken by another file of the batch moved to a temporary
+        # name. Second pass: temporary names to their targets.
+        renamed = {}
+        deferred = []
+        for audio, source, destination in moves:
+            if destination == source:
+                self.unchanged += 1
+                renamed[id(audio)] = source
+                continue
+            try:
+                if os.path.lexists(destination):
+                    temporary = source.with_name(
+                            f".{source.name}.{os.getpid()}.rename")
+                    self.rename(audio, source, temporary)
+                    deferred.append((audio, source, temporary, destination))
+                    continue
+                self.rename(audio, source, destination)
+            except OSError as error:
+                self.errors.append((source, error))
+                continue
+            relocateAudio(audio, destination)
+            renamed[id(audio)] = destination
+            self.renamed += 1
+        for audio, source, temporary, destination in deferred:
+            try:
+                self.rename(audio, temporary, destination)
+            except OSError as error:
+                self.errors.append((source, error))
+                try:
+                    self.rename(audio, temporary, source)
+                except OSError:
+                    relocateAudio(audio, temporary)
+                continue
+            relocateAudio(audio, destination)
+            renamed[id(audio)] = destination
+            self.renamed += 1
+        return [(audio, renamed[id(audio)])
+                for audio, source, destination in moves
+                if id(audio) in renamed]
+
+    def renameStage(self, audio, path):
+        result = self.run(self.plan([(audio, path)]))
+        if not result:
+            return None
+        return result[0][1]
+
+    def report(self):
+        if self.renamed or self.unchanged:
+            console.print(f"Renamed {self.renamed} file(s), "
+                          f"{self.unchanged} already named.")
+        if self.errors:
+            console.print(f"[bold red]Could not rename {len(self.errors)} "
+                          f"file(s):[/]")
+            for path, error in self.errors:
+                console.print(f"  {path} : {error}")
+
+
+def renameAudioFiles(audio_files, template=DEFAULT_NAME_TEMPLATE):
+    planner = RenamePlanner(template)
+    with console.status("Renaming audio files..", spinner="line"):
+        result = planner.run(planner.plan(audio_files))
+    planner.report()
+    return result
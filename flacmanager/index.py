@@ -0,0 +1,253 @@
+import json
+import os
+import sqlite3
+import time
+
+from pathlib import Path
+
+from flacmanager.audio import LazyAudio, audioKind, vorbisTags
+from flacmanager.ui import console
+
+
+def defaultCacheDirectory():
+    base = os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = Path.home() / ".cache"
+    return Path(base) / "flacmanager"
+
+
+# Seconds a write waits for another process holding the index, such as
+# another shard or the server, before the run goes on without caching.
+INDEX_TIMEOUT = 10
+# Writes are committed every COMMIT_BATCH entries or COMMIT_SECONDS, so
+# that no run holds the write lock for its whole scan.
+COMMIT_BATCH = 500
+COMMIT_SECONDS = 1
+
+
+class MetadataIndex:
+    # The index opened last, kept up to date by the saves of the run.
+    active = None
+
+    def __init__(self, path=None, reindex=False):
+        if path is None:
+            path = defaultCacheDirectory() / "index.sqlite3"
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=INDEX_TIMEOUT)
+        # Readers and the writer of the write-ahead log do not block each
+        # other. Filesystems without shared memory keep the default.
+        try:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error:
+            pass
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS tracks ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "tags TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "signature TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS directories ("
+            "path TEXT PRIMARY KEY, "
+            "mtime_ns INTEGER NOT NULL, "
+            "sniff INTEGER NOT NULL, "
+            "entries TEXT NOT NULL)"
+        )
+        self.connection.commit()
+        self.reindex = reindex
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+        self.committed = time.monotonic()
+        self.failed = False
+        self.functions = False
+        MetadataIndex.active = self
+
+    @staticmethod
+    def key(path):
+        return os.path.abspath(path)
+
+    def fail(self, error):
+        # The rest of the run goes on without reading or updating the
+        # index, once it is locked for too long or cannot be written.
+        if not self.failed:
+            console.print(f"[bold red]Could not use the metadata index "
+                          f"({error}), continuing without it.[/]")
+        self.failed = True
+        try:
+            self.connection.rollback()
+        except sqlite3.Error:
+            pass
+
+    def read(self, statement, params):
+        if self.reindex or self.failed:
+            return None
+        try:
+            return self.connection.execute(statement, params).fetchone()
+        except sqlite3.Error as error:
+            self.fail(error)
+            return None
+
+    def write(self, statement, params):
+        if self.failed:
+            return
+        try:
+            self.connection.execute(statement, params)
+            self.pending += 1
+            if (self.pending >= COMMIT_BATCH
+                    or time.monotonic() - self.committed >= COMMIT_SECONDS):
+                self.commit()
+        except sqlite3.Error as error:
+            self.fail(error)
+
+    def commit(self):
+        self.connection.commit()
+        self.pending = 0
+        self.committed = time.monotonic()
+
+    def lookup(self, path, stat):
+        row = self.read(
+            "SELECT size, mtime_ns, inode, kind, tags "
+            "FROM tracks WHERE path = ?",
+            (self.key(path),)
+        )
+        if row is None or row[:3] != (stat.st_size,
+                                      stat.st_mtime_ns,
+                                      stat.st_ino):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return LazyAudio(path, json.loads(row[4]), row[3])
+
+    def store(self, path, stat, audio):
+        tags = vorbisTags(audio)
+        if tags is None:
+            return
+        self.write(
+            "INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+            (self.key(path),
+             stat.st_size,
+             stat.st_mtime_ns,
+             stat.st_ino,
+             audioKind(audio),
+             json.dumps(tags))
+        )
+
+    def saved(self, audio):
+        # Called once audio has been written: an in-place write keeps the
+        # size of the file, and a coarse mtime may not tell the entry is
+        # stale, so the new tags are stored right away. The audio frames
+        # are not rewritten, but the signature entry is dropped rather than
+        # trusted under a new mtime.
+        path = audio.filename
+        self.write("DELETE FROM signatures WHERE path = ?", (self.key(path),))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is None or vorbisTags(audio) is None:
+            self.write("DELETE FROM tracks WHERE path = ?", (self.key(path),))
+        else:
+            self.store(path, stat, audio)
+
+    def registerFunctions(self):
+        # The SQL functions the conditions of query.compileSQL rely on.
+        from flacmanager.query import compilePattern, leadingNumber
+
+        self.connection.create_function(
+                "regexp", 2,
+                lambda pattern, value: value is not None
+                and compilePattern(pattern).search(value) is not None,
+                deterministic=True)
+        self.connection.create_function(
+                "fold", 1,
+                lambda value: value.casefold()
+                if isinstance(value, str) else value,
+                deterministic=True)
+        self.connection.create_function(
+                "number", 1,
+                lambda value: leadingNumber(value)
+                if isinstance(value, str) else None,
+                deterministic=True)
+        self.functions = True
+
+    def match(self, path, condition, params=()):
+        # Returns (size, mtime_ns, inode, matched) for the entry of path,
+        # matched being the value of condition (see query.compileSQL). One
+        # primary key lookup per file, rather than the whole table.
+        if not self.functions:
+            self.registerFunctions()
+        return self.read(
+            f"SELECT size, mtime_ns, inode, {condition} "
+            f"FROM tracks WHERE path = ?",
+            tuple(params) + (self.key(path),)
+        )
+
+    def lookupSignature(self, path, stat):
+        row = self.read(
+            "SELECT size, mtime_ns, inode, signature "
+            "FROM signatures WHERE path = ?",
+            (self.key(path),)
+        )
+        if row is None or row[:3] != (stat.st_size,
+                                      stat.st_mtime_ns,
+                                      stat.st_ino):
+            return None
+        return row[3]
+
+    def storeSignature(self, path, stat, signature):
+        self.write(
+            "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?, ?)",
+            (self.key(path),
+             stat.st_size,
+             stat.st_mtime_ns,
+             stat.st_ino,
+             signature)
+        )
+
+    def lookupDirectory(self, path, mtime_ns, sniff):
+        # Returns the entries recorded by the last scan of the directory,
+        # see scan.listDirectory.
+        row = self.read(
+            "SELECT mtime_ns, sniff, entries FROM directories WHERE path = ?",
+            (self.key(path),)
+        )
+        if row is None or row[:2] != (mtime_ns, int(sniff)):
+            return None
+        return [tuple(entry) for entry in json.loads(row[2])]
+
+    def storeDirectory(self, path, mtime_ns, sniff, entries):
+        self.write(
+            "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+            (self.key(path), mtime_ns, int(sniff), json.dumps(entries))
+        )
+
+    def close(self):
+        if MetadataIndex.active is self:
+            MetadataIndex.active = None
+        if not self.failed:
+            try:
+                self.commit()
+            except sqlite3.Error as error:
+                self.fail(error)
+        self.connection.close()
+
+
+def openMetadataIndex(reindex=False):
+    try:
+        return MetadataIndex(reindex=reindex)
+    except (OSError, sqlite3.Error) as error:
+        console.print(f"[bold red]Could not open the metadata index "
+                      f"({error}), continuing without it.[/]")
+        return None
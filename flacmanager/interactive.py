@@ -0,0 +1,142 @@
+from rich.prompt import Prompt
+
+from flacmanager.audio import firstValue
+from flacmanager.editing import (
+        applyPresets,
+        filterAudioFiles,
+        modifyMetadata,
+        orderAudioFiles,
+        )
+from flacmanager.files import renameAudioFiles
+from flacmanager.selection import listSelection, pickIndices
+from flacmanager.transaction import TagTransaction, saveAudio
+from flacmanager.ui import console, printMetadata
+
+
+def interactiveHelp():
+    console.print('''
+------------------------------------
+    help - Prints this help.
+    list - Lists audio files.
+    tweak - Iterates through audio files and prompts for modification.
+    filter - Filters audio files using regex.
+    modify - Bulk-modifies tags.
+    preset - Apply formatting presets.
+    order - Prefixes title with tracknumber.
+    rename - Renames files using tracknumber and title.
+    exit - Quits the interactive mode.
+------------------------------------
+                  ''')
+
+
+def promptUser(choices, prefix="[bold cyan]i>[/]", default="help"):
+    choice = Prompt.ask(prompt=prefix, choices=choices, default=default)
+    return choice
+
+
+def interactiveMode(audio_files, write_jobs=1, journal=None):
+    console.print("Welcome to the interactive mode.")
+    choice = ""
+    filtered_audio_files = audio_files
+    filterMode = False
+    while choice != "exit":
+        if not filterMode:
+            choice = promptUser(("help",
+                                 "list",
+                                 "filter",
+                                 "tweak",
+                                 "modify",
+                                 "preset",
+                                 "order",
+                                 "rename",
+                                 "exit"
+                                 ))
+        else:
+            choice = promptUser(("help",
+                                 "list",
+                                 "restore",
+                                 "tweak",
+                                 "modify",
+                                 "preset",
+                                 "order",
+                                 "rename",
+                                 "exit"),
+                                "[bold yellow]f>[/]"
+                                )
+        if choice == "help":
+            interactiveHelp()
+        elif choice == "list":
+            printMetadata(filtered_audio_files)
+        elif choice == "tweak":
+            tag = listSelection("Select a tag to tweak:",
+                                ("artist",
+                                 "album",
+                                 "genre",
+                                 "tracknumber",
+                                 "title"))
+            filtered = selectAudioFiles(filtered_audio_files)
+            with TagTransaction(filtered,
+                                write_jobs=write_jobs,
+                                journal=journal):
+                tweakAudioFiles(tag, filtered)
+        elif choice == "modify":
+            with TagTransaction(filtered_audio_files,
+                                write_jobs=write_jobs,
+                                journal=journal):
+                modifyMetadata(filtered_audio_files, False, [])
+        elif choice == "preset":
+            with TagTransaction(filtered_audio_files,
+                                write_jobs=write_jobs,
+                                journal=journal):
+                applyPresets(filtered_audio_files)
+        elif choice == "order":
+            with TagTransaction(filtered_audio_files,
+                                write_jobs=write_jobs,
+                                journal=journal):
+                orderAudioFiles(filtered_audio_files)
+        elif choice == "rename":
+            audio_files = renameAudioFiles(filtered_audio_files)
+        elif choice == "filter":
+            regex = Prompt.ask("Pattern to match", default="^.*$")
+            result = filterAudioFiles(audio_files, regex, "")
+            if len(result) > 0:
+                filtered_audio_files = result
+                filterMode = True
+        elif choice == "restore":
+            filtered_audio_files = audio_files
+            filterMode = False
+
+
+def tweakAudioFiles(tag, audio_files):
+    if len(audio_files) < 1:
+        console.print("[bold red]Empty selection. Nothing to do.[/]")
+        return
+    console.print('[dim italic][Commands : c to continue,'
+                  'q to exit tweak mode][/]')
+    for audio, path in audio_files:
+        if tag in audio.tags:
+            old_value = audio.tags[tag][0]
+        else:
+            old_value = ""
+        choice = Prompt.ask(
+            f"[italic cyan]{path.name}[/] : "
+            f"[[bold]{old_value}[/]] -> [?] ",
+            default=old_value
+            )
+        if choice == 'q':
+            break
+        elif choice == 'c':
+            continue
+        else:
+            audio.tags[tag] = choice
+            saveAudio(audio)
+
+
+def selectAudioFiles(audio_files):
+    choices = [f"{firstValue(audio, 'artist') or '?'}"
+               f" - {firstValue(audio, 'album') or '?'}"
+               f" - {firstValue(audio, 'title') or path.name}"
+               for audio, path in audio_files]
+    selection = pickIndices("\nPlease select one, or many, audio files",
+                            choices)
+    return [audio_files[index] for index in selection]
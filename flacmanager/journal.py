@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import time
+
+from pathlib import Path
+
+from flacmanager.audio import audioKind, replaceTags, vorbisTags
+from flacmanager.index import defaultCacheDirectory
+from flacmanager.scan import parseAudioPath
+from flacmanager.transaction import TagTransaction, saveAudio
+from flacmanager.ui import console
+
+
+JOURNAL_HISTORY = 20
+
+
+def journalDirectory():
+    return defaultCacheDirectory() / "journal"
+
+
+class WriteJournal:
+    # Write-ahead log of the tag writes of a run. The original and the new
+    # tags of a batch are on disk before any file of the batch is saved,
+    # so an interrupted run can be rolled back or finished later.
+    def __init__(self, argv=(), path=None):
+        self.argv = list(argv)
+        self.path = path
+        self.file = None
+
+    def open(self):
+        if self.path is None:
+            directory = journalDirectory()
+            directory.mkdir(parents=True, exist_ok=True)
+            pruneJournals(directory, JOURNAL_HISTORY - 1)
+            self.path = directory / f"{time.time_ns()}.jsonl"
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.append({"started": time.strftime("%Y-%m-%d %H:%M:%S"),
+                     "cwd": os.getcwd(),
+                     "argv": self.argv})
+
+    def append(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def plan(self, entries):
+        records = []
+        for audio, original, dirty, forced, trim in entries:
+            tags = vorbisTags(audio)
+            if original is None or tags is None:
+                continue
+            records.append({"path": os.path.abspath(audio.filename),
+                            "kind": audioKind(audio),
+                            "before": original,
+                            "after": tags})
+        if not records:
+            return
+        if self.file is None:
+            self.open()
+        for record in records:
+            self.append(record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def done(self, path):
+        if self.file is not None:
+            self.append({"done": os.path.abspath(path)})
+
+    def sync(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.append({"finished": True})
+            self.file.close()
+            self.file = None
+
+
+def pruneJournals(directory, keep):
+    journals = sorted(Path(directory).glob("*.jsonl"))
+    for path in journals[:max(len(journals) - keep, 0)]:
+        path.unlink()
+
+
+def latestJournal():
+    journals = sorted(journalDirectory().glob("*.jsonl"))
+    if not journals:
+        return None
+    return journals[-1]
+
+
+def readJournal(path):
+    # Keeps the first original and the last new tags of every file, since
+    # a file can be saved by several transactions of the same run.
+    header = {}
+    files = {}
+    done = set()
+    finished = False
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn last line of an interrupted run.
+                break
+            if "started" in record:
+                header = record
+            elif "path" in record:
+                if record["path"] in files:
+                    files[record["path"]]["after"] = record["after"]
+                else:
+                    files[record["path"]] = record
+                done.discard(record["path"])
+            elif "done" in record:
+                done.add(record["done"])
+            elif "finished" in record:
+                finished = True
+    return header, files, done, finished
+
+
+def printJournals():
+    from rich import box
+    from rich.table import Table
+
+    table = Table(box=box.MINIMAL)
+    table.add_column("Journal")
+    table.add_column("Started")
+    table.add_column("Command")
+    table.add_column("Files", justify="right")
+    table.add_column("Saved", justify="right")
+    table.add_column("Finished")
+    for path in sorted(journalDirectory().glob("*.jsonl"), reverse=True):
+        header, files, done, finished = readJournal(path)
+        table.add_row(path.name,
+                      header.get("started", ""),
+                      " ".join(header.get("argv", [])),
+                      str(len(files)),
+                      str(len(done)),
+                      "yes" if finished else "[bold red]no[/]")
+    console.print(table)
+
+
+def replayJournal(files, key, write_jobs=1):
+    # Writes the key ("before" or "after") tags of every file back. Files
+    # that already hold those tags are left alone.
+    errors = []
+    with TagTransaction(write_jobs=write_jobs) as transaction:
+        for path, record in files.items():
+            audio, stat, error, bytes_read = parseAudioPath(path)
+            if audio is None:
+                errors.append((path, error or "not an audio file."))
+                continue
+            if vorbisTags(audio) is None:
+                errors.append((path, "has no Vorbis comments."))
+                continue
+            transaction.watch(audio)
+            replaceTags(audio, record[key])
+            saveAudio(audio)
+    for path, error in errors:
+        console.print(f"  {path} : {error}")
+
+
+def journalMain(command, arguments):
+    journal_parser = argparse.ArgumentParser(
+            prog=f"flacmanager {command}",
+            description='Rolls back every tag write of a run.'
+            if command == "undo" else
+            'Finishes the tag writes of an interrupted run.')
+    journal_parser.add_argument("journal",
+                                nargs="?",
+                                help='journal file, defaults to the one of '
+                                     'the last run')
+    journal_parser.add_argument("--write-jobs",
+                                type=int,
+                                default=1,
+                                metavar="N",
+                                help='Saves files with N concurrent writers.')
+    journal_parser.add_argument("-l",
+                                "--list",
+                                action="store_true",
+                                help='Lists the journals of the last runs.')
+    journal_parser.add_argument("-y",
+                                "--yes",
+                                action="store_true",
+                                help='Does not ask for confirmation.')
+    args = journal_parser.parse_args(arguments)
+
+    if args.list:
+        printJournals()
+        return
+    path = args.journal
+    if path is None:
+        path = latestJournal()
+        if path is None:
+            console.print("[bold red]No journal found. Nothing to do.[/]")
+            return
+    header, files, done, finished = readJournal(path)
+    if command == "resume":
+        if finished:
+            console.print("This run was not interrupted. Nothing to do.")
+            return
+        files = {path: record for path, record in files.items()
+                 if path not in done}
+        key = "after"
+        action = "Finish saving"
+    else:
+        key = "before"
+        action = "Restore the original tags of"
+    if not files:
+        console.print("No file to write. Nothing to do.")
+        return
+    console.print(f"Run of {header.get('started', '?')} : "
+                  f"flacmanager {' '.join(header.get('argv', []))}")
+    if not args.yes:
+        from rich.prompt import Confirm
+
+        if not Confirm.ask(f"{action} {len(files)} file(s)?"):
+            return
+    replayJournal(files, key, args.write_jobs)
@@ -0,0 +1,172 @@
+import os
+import re
+
+from flacmanager.artwork import ArtExtractor, loadCoverArt, setCoverArt
+from flacmanager.consistency import ConsistencyReport, applyEdits
+from flacmanager.editing import (
+        RegexRule,
+        applyChanges,
+        matchesFilter,
+        orderAudioFile,
+        stripAudioFile,
+        )
+from flacmanager.files import RenamePlanner, SortPlanner
+from flacmanager.stats import measure
+from flacmanager.transaction import TagTransaction, reservePadding, saveAudio
+from flacmanager.ui import console
+
+
+def filterStage(regex, target_tags):
+    regex = re.compile(regex)
+
+    def stage(audio, path):
+        if matchesFilter(audio, regex, target_tags):
+            return path
+        return None
+    return stage
+
+
+def regexStage(target_tags, regex, replace):
+    rule = RegexRule(regex, target_tags, replace)
+
+    def stage(audio, path):
+        changes = rule.changes(audio)
+        if changes:
+            applyChanges(audio, changes)
+        return path
+    return stage
+
+
+def measureStage(name, stage):
+    def measured(audio, path):
+        with measure(name, 1):
+            return stage(audio, path)
+    return measured
+
+
+def confirm(question):
+    from rich.prompt import Confirm
+
+    return Confirm.ask(question)
+
+
+def streamStages(args, reports=None, edits=None):
+    # Every confirmation is asked once, before the scan starts, since the
+    # number of files is not known until the stream has been consumed.
+    stages = []
+    if args.filter:
+        stages.append(("filter",
+                       filterStage(re.compile(args.filter[1]),
+                                   args.filter[0].split(";"))))
+    if args.reserve_padding is not None:
+        def paddingStage(audio, path):
+            reservePadding([(audio, path)], args.reserve_padding)
+            return path
+        stages.append(("padding", paddingStage))
+    # Stages that sum up their work at the end of the stream are added to
+    # reports.
+    if reports is None:
+        reports = []
+    if args.extract_art:
+        extractor = ArtExtractor(args.strip_art and confirm(
+                "This will remove the embedded pictures of every processed "
+                "file once they are written as sidecars. Proceed?"))
+        reports.append(extractor)
+        stages.append(("extract-art", extractor.extract))
+    if args.delete:
+        if confirm("This will remove ALL tags and cover art except: "
+                   "artist, album, genre, tracknumber, title "
+                   "from every processed file. Proceed?"):
+            def deleteStage(audio, path):
+                saveAudio(audio, stripAudioFile(audio))
+                return path
+            stages.append(("delete", deleteStage))
+        else:
+            console.print("No modifications have been made.")
+    if args.rename:
+        renamer = RenamePlanner(args.name_template)
+        reports.append(renamer)
+        stages.append(("rename", renamer.renameStage))
+    if args.order:
+        def orderStage(audio, path):
+            if orderAudioFile(audio, path):
+                saveAudio(audio)
+            return path
+        stages.append(("order", orderStage))
+    if args.modify:
+        target_tags = args.modify[0].split(";")
+        if confirm(f"This will replace {', '.join(target_tags)} "
+                   f"by {args.modify[1]} in every processed file. "
+                   f"Proceed?"):
+            stages.append(("modify",
+                           regexStage(target_tags, r'^.*$', args.modify[1])))
+        else:
+            console.print("No modifications have been made.")
+    if edits is not None:
+        if confirm(f"This will replace "
+                   f"{sum(map(len, edits.values()))} value(s) listed in "
+                   f"{args.apply_edits} in every processed file. "
+                   f"Proceed?"):
+            def editStage(audio, path):
+                applyEdits(audio, edits)
+                return path
+            stages.append(("apply-edits", editStage))
+        else:
+            console.print("No modifications have been made.")
+    if args.picture:
+        coverArt = loadCoverArt(args.picture[0],
+                                args.picture_size,
+                                args.picture_quality)
+        if coverArt is not None and confirm(
+                f"{args.picture[0]} will be the cover art for every "
+                f"processed file. Proceed?"):
+            def pictureStage(audio, path):
+                if setCoverArt(audio, coverArt):
+                    saveAudio(audio, True)
+                return path
+            stages.append(("picture", pictureStage))
+    if args.sort:
+        planner = SortPlanner(args.sort if os.path.isdir(args.sort) else "",
+                              args.sort_mode,
+                              args.transfer_jobs)
+        reports.append(planner)
+        stages.append(("sort", planner.sortStage))
+    if args.consistency:
+        report = ConsistencyReport(args.consistency_tags.split(";"),
+                                   args.consistency_edits)
+        reports.append(report)
+        stages.append(("consistency", report.add))
+    return [measureStage(name, stage) for name, stage in stages]
+
+
+def streamAudioFiles(audio_files,
+                     stages,
+                     listing=None,
+                     exporter=None):
+    # Runs every stage on a file, saves it at most once and lets it go
+    # before the next one is read, so memory does not grow with the
+    # library. Listed rows are printed a page at a time as they come.
+    processed = 0
+    transaction = TagTransaction.active
+    for audio, path in audio_files:
+        if transaction is not None:
+            transaction.watch(audio)
+        for stage in stages:
+            path = stage(audio, path)
+            if path is None:
+                break
+        if transaction is not None:
+            transaction.commit(audio)
+        if path is None:
+            continue
+        processed += 1
+        if exporter is not None:
+            with measure("export", 1):
+                exporter.write(audio, path)
+        if listing is not None:
+            with measure("list", 1):
+                listing.add(audio, path)
+    if listing is not None:
+        with measure("list"):
+            listing.close()
+    return processed
@@ -0,0 +1,236 @@
+import functools
+import os
+import re
+
+
+TOKEN = re.compile(r'\s*(?:(\()|(\))|(!=|!~|<=|>=|=|~|<|>)'
+                   r'|"((?:[^"\\]|\\.)*)"|([^\s()=!~<>"]+))')
+KEYWORDS = ("and", "or", "not", "has", "missing")
+NUMERIC_OPERATORS = ("<", "<=", ">", ">=")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def leadingNumber(value):
+    # "3/12" is track 3 and "2001-05-03" the year 2001.
+    match = re.match(r"\s*(\d+)", value)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+@functools.lru_cache(maxsize=64)
+def compilePattern(pattern):
+    return re.compile(pattern)
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise QueryError(f"unexpected {text[position:]!r}")
+        opening, closing, operator, quoted, word = match.groups()
+        if opening or closing:
+            tokens.append(("paren", opening or closing))
+        elif operator:
+            tokens.append(("operator", operator))
+        elif quoted is not None:
+            tokens.append(("value", re.sub(r"\\(.)", r"\1", quoted)))
+        elif word.lower() in KEYWORDS:
+            tokens.append(("keyword", word.lower()))
+        else:
+            tokens.append(("value", word))
+        position = match.end()
+    return tokens
+
+
+class Parser:
+    # query := term ("or" term)*
+    # term := factor ("and" factor)*
+    # factor := "not" factor | "(" query ")" | ("has" | "missing") TAG
+    #         | TAG OPERATOR VALUE
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind is not None and token[0] != kind) or (
+                value is not None and token[1] != value):
+            expected = value or kind or "more"
+            found = token[1] if token[0] else "the end of the query"
+            raise QueryError(f"expected {expected}, found {found}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.query()
+        if self.peek()[0] is not None:
+            raise QueryError(f"unexpected {self.peek()[1]}")
+        return node
+
+    def query(self):
+        nodes = [self.term()]
+        while self.peek() == ("keyword", "or"):
+            self.take()
+            nodes.append(self.term())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def term(self):
+        nodes = [self.factor()]
+        while self.peek() == ("keyword", "and"):
+            self.take()
+            nodes.append(self.factor())
+        return nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+    def factor(self):
+        kind, value = self.peek()
+        if (kind, value) == ("keyword", "not"):
+            self.take()
+            return ("not", self.factor())
+        if (kind, value) == ("paren", "("):
+            self.take()
+            node = self.query()
+            self.take("paren", ")")
+            return node
+        if kind == "keyword" and value in ("has", "missing"):
+            self.take()
+            tag = self.take("value")[1].lower()
+            node = ("has", tag)
+            return node if value == "has" else ("not", node)
+        tag = self.take("value")[1].lower()
+        operator = self.take("operator")[1]
+        operand = self.take("value")[1]
+        if operator in NUMERIC_OPERATORS:
+            try:
+                operand = int(operand)
+            except ValueError:
+                raise QueryError(f"{tag} {operator} needs a number, "
+                                 f"not {operand!r}") from None
+        elif operator in ("~", "!~"):
+            try:
+                compilePattern(operand)
+            except re.error as error:
+                raise QueryError(f"invalid pattern {operand!r}: {error}")
+        if operator in ("!=", "!~"):
+            return ("not", ("compare", tag, operator[1], operand))
+        return ("compare", tag, operator, operand)
+
+
+def tagValues(audio, tag):
+    values = audio.tags.get(tag)
+    if not values:
+        return ()
+    if isinstance(values, str):
+        return (values,)
+    return [str(value) for value in values]
+
+
+def comparePredicate(tag, operator, operand):
+    if operator == "=":
+        operand = operand.casefold()
+        return lambda audio: any(value.casefold() == operand
+                                 for value in tagValues(audio, tag))
+    if operator == "~":
+        search = compilePattern(operand).search
+        return lambda audio: any(search(value)
+                                 for value in tagValues(audio, tag))
+    compare = {"<": int.__lt__,
+               "<=": int.__le__,
+               ">": int.__gt__,
+               ">=": int.__ge__}[operator]
+
+    def predicate(audio):
+        for value in tagValues(audio, tag):
+            number = leadingNumber(value)
+            if number is not None and compare(number, operand):
+                return True
+        return False
+    return predicate
+
+
+def compilePredicate(node):
+    kind = node[0]
+    if kind == "and":
+        predicates = [compilePredicate(child) for child in node[1]]
+        return lambda audio: all(predicate(audio)
+                                 for predicate in predicates)
+    if kind == "or":
+        predicates = [compilePredicate(child) for child in node[1]]
+        return lambda audio: any(predicate(audio)
+                                 for predicate in predicates)
+    if kind == "not":
+        predicate = compilePredicate(node[1])
+        return lambda audio: not predicate(audio)
+    if kind == "has":
+        tag = node[1]
+        return lambda audio: any(tagValues(audio, tag))
+    return comparePredicate(*node[1:])
+
+
+def compileSQL(node, params):
+    # Builds a condition on the JSON tags column of the index, appending
+    # its parameters to params. Tags are stored as lists, so a comparison
+    # holds when any value of the tag matches.
+    kind = node[0]
+    if kind in ("and", "or"):
+        return "(" + f" {kind.upper()} ".join(compileSQL(child, params)
+                                               for child in node[1]) + ")"
+    if kind == "not":
+        return f"NOT {compileSQL(node[1], params)}"
+    params.append(f'$."{node[1]}"')
+    if kind == "has":
+        return ("EXISTS (SELECT 1 FROM json_each(tags, ?) "
+                "WHERE value != '')")
+    tag, operator, operand = node[1:]
+    if operator == "=":
+        condition = "fold(value) = ?"
+        params.append(operand.casefold())
+    elif operator == "~":
+        condition = "regexp(?, value)"
+        params.append(operand)
+    else:
+        condition = f"number(value) {operator} ?"
+        params.append(operand)
+    return f"EXISTS (SELECT 1 FROM json_each(tags, ?) WHERE {condition})"
+
+
+class Query:
+    def __init__(self, text):
+        self.text = text
+        node = Parser(text).parse()
+        self.matches = compilePredicate(node)
+        self.params = []
+        self.sql = compileSQL(node, self.params)
+
+    def prefilter(self, paths, index):
+        # Answers the query from the index for every file whose entry is
+        # still fresh, so that only new or modified files are parsed.
+        # Yields the paths that still have to be parsed and checked.
+        if index is None or index.reindex:
+            yield from paths
+            return
+        for path in paths:
+            row = index.match(path, self.sql, self.params)
+            if row is not None:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    yield path
+                    continue
+                if (row[:3] == (stat.st_size,
+                                stat.st_mtime_ns,
+                                stat.st_ino)
+                        and not row[3]):
+                    continue
+            yield path
@@ -0,0 +1,274 @@
+import os
+import sys
+import time
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from flacmanager.audio import (
+        LazyAudio,
+        audioKind,
+        ensureBasicTags,
+        readFlacTags,
+        vorbisTags,
+        )
+from flacmanager.stats import countResult, recordIO
+from flacmanager.ui import console
+
+
+def parseAudioPath(path):
+    # Returns (audio, stat, error, bytes read). Files handed to mutagen are
+    # counted as read in full since it does not report what it reads.
+    # Files with Vorbis comments are kept as a LazyAudio record of their
+    # tags rather than as the whole mutagen object.
+    import mutagen
+    from mutagen import MutagenError
+
+    try:
+        stat = os.stat(path)
+        tags = None
+        if Path(path).suffix.lower() == ".flac":
+            tags, bytes_read = readFlacTags(path)
+        if tags is not None:
+            return LazyAudio(path, tags, "FLAC"), stat, None, bytes_read
+        audio = mutagen.File(path)
+        if audio is not None and audio.tags is not None:
+            tags = vorbisTags(audio)
+            if tags is not None:
+                audio = LazyAudio(path, tags, audioKind(audio))
+        return audio, stat, None, stat.st_size
+    except (MutagenError, OSError) as error:
+        return None, None, error, 0
+
+
+def readAudioPaths(paths, index=None, jobs=1):
+    # Yields (path, audio, error) in the order of paths. Index hits are
+    # resolved on the calling thread, misses are parsed by the pool.
+    executor = ThreadPoolExecutor(jobs) if jobs > 1 else None
+    window = max(jobs, 1) * 4
+    pending = deque()
+
+    def resolve(path, outcome):
+        if isinstance(outcome, Future):
+            outcome = outcome.result()
+        audio, stat, error, bytes_read = outcome
+        recordIO(bytes_read=bytes_read)
+        if (index is not None
+                and stat is not None
+                and audio is not None
+                and audio.tags is not None):
+            index.store(path, stat, audio)
+        return path, audio, error
+
+    try:
+        for path in paths:
+            outcome = None
+            if index is not None:
+                try:
+                    cached = index.lookup(path, os.stat(path))
+                except OSError as error:
+                    outcome = (None, None, error, 0)
+                else:
+                    if cached is not None:
+                        outcome = (cached, None, None, 0)
+            if outcome is None:
+                if executor is not None:
+                    outcome = executor.submit(parseAudioPath, path)
+                else:
+                    outcome = parseAudioPath(path)
+            pending.append((path, outcome))
+            while len(pending) >= window:
+                yield resolve(*pending.popleft())
+        while pending:
+            yield resolve(*pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def reportReadErrors(errors):
+    countResult("read_errors", len(errors))
+    if not errors:
+        return
+    console.print(f"[bold red]Could not read {len(errors)} file(s):[/]")
+    for path, error in errors:
+        console.print(f"  {path} : {error}")
+
+
+def iterAudioPaths(paths, index=None, jobs=1, errors=None, query=None):
+    if query is not None:
+        paths = query.prefilter(paths, index)
+    for path, audio, error in readAudioPaths(paths, index, jobs):
+        if error is not None:
+            if errors is not None:
+                errors.append((path, error))
+        elif audio is not None:
+            ensureBasicTags(audio)
+            if query is None or query.matches(audio):
+                yield audio, path
+
+
+def iterAudioFiles(arguments,
+                   index=None,
+                   jobs=1,
+                   errors=None,
+                   query=None,
+                   shard=None):
+    paths = [Path(argument) for argument in sorted(list(arguments))]
+    if shard is not None:
+        paths = [path for path in paths if shard.owns(path)]
+    yield from iterAudioPaths(paths, index, jobs, errors, query)
+
+
+AUDIO_EXTENSIONS = frozenset((".aac", ".aif", ".aifc", ".aiff", ".ape",
+                              ".asf", ".dff", ".dsf", ".flac", ".m4a",
+                              ".m4b", ".mp2", ".mp3", ".mp4", ".mpc",
+                              ".oga", ".ogg", ".ofr", ".opus", ".spx",
+                              ".tak", ".tta", ".wav", ".wma", ".wv"))
+AUDIO_MAGIC = (b"fLaC", b"ID3", b"OggS", b"MAC ", b"wvpk", b"MPCK", b"MP+",
+               b"TTA1", b"tBaK", b"DSD ", b"FRM8", b"OFR ",
+               b"\x30\x26\xb2\x75")
+# Directories modified this recently may still change within the same
+# mtime tick, so their listing is not recorded.
+LISTING_SETTLE_NS = 2_000_000_000
+
+
+def sniffAudio(path):
+    # Reads the first bytes of a file without an audio extension and tells
+    # whether it starts like one of the formats mutagen reads.
+    try:
+        with open(path, "rb") as file:
+            head = file.read(12)
+    except OSError:
+        return False
+    recordIO(bytes_read=len(head))
+    if head[:4] == b"RIFF":
+        return head[8:12] == b"WAVE"
+    if head[:4] == b"FORM":
+        return head[8:12] in (b"AIFF", b"AIFC")
+    return (head.startswith(AUDIO_MAGIC)
+            or head[4:8] == b"ftyp"
+            or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0))
+
+
+class DirectoryListings:
+    # In-memory scan record, for a process scanning the same tree again
+    # and again. The metadata index keeps the same record on disk.
+    def __init__(self):
+        self.listings = {}
+
+    def lookupDirectory(self, path, mtime_ns, sniff):
+        listing = self.listings.get(path)
+        if listing is None or listing[:2] != (mtime_ns, sniff):
+            return None
+        return listing[2]
+
+    def storeDirectory(self, path, mtime_ns, sniff, entries):
+        self.listings[path] = (mtime_ns, sniff, entries)
+
+
+def listDirectory(directory, sniff=False, record=None):
+    # Returns the (name, is directory) entries of directory worth visiting,
+    # in name order. Files are kept when their extension is an audio one,
+    # or when they start like an audio file with sniff. A directory whose
+    # mtime matches the record was not added to or removed from since the
+    # last scan, and its recorded entries are used without listing it.
+    mtime_ns = None
+    if record is not None:
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            return []
+        entries = record.lookupDirectory(str(directory), mtime_ns, sniff)
+        if entries is not None:
+            return entries
+    entries = []
+    try:
+        with os.scandir(directory) as iterator:
+            for entry in sorted(iterator, key=lambda entry: entry.name):
+                if entry.is_dir(follow_symlinks=False):
+                    entries.append((entry.name, True))
+                elif not entry.is_file():
+                    continue
+                elif (os.path.splitext(entry.name)[1].lower()
+                        in AUDIO_EXTENSIONS
+                        or (sniff and sniffAudio(entry.path))):
+                    entries.append((entry.name, False))
+    except OSError:
+        return []
+    if (mtime_ns is not None
+            and time.time_ns() - mtime_ns > LISTING_SETTLE_NS):
+        record.storeDirectory(str(directory), mtime_ns, sniff, entries)
+    return entries
+
+
+def walkDirectory(directory, is_recursive=False, sniff=False, record=None):
+    # Visiting entries in name order, depth first, yields the same order as
+    # sorted(Path.rglob("*")) without holding the whole tree in memory.
+    for name, is_directory in listDirectory(directory, sniff, record):
+        path = Path(directory) / name
+        if not is_directory:
+            yield path
+        elif is_recursive:
+            yield from walkDirectory(path, is_recursive, sniff, record)
+
+
+def iterAudioDirectories(arguments,
+                         is_recursive=False,
+                         index=None,
+                         jobs=1,
+                         errors=None,
+                         query=None,
+                         sniff=False,
+                         shard=None):
+    paths = (path
+             for directory in sorted(arguments, key=Path)
+             for path in walkDirectory(Path(directory),
+                                       is_recursive,
+                                       sniff,
+                                       index)
+             if shard is None or shard.owns(path.relative_to(directory)))
+    yield from iterAudioPaths(paths, index, jobs, errors, query)
+
+
+def parseAudioFiles(arguments, index=None, jobs=1, query=None, shard=None):
+    errors = []
+    audio_files = list(iterAudioFiles(arguments,
+                                      index,
+                                      jobs,
+                                      errors,
+                                      query,
+                                      shard))
+    reportReadErrors(errors)
+    if not audio_files:
+        console.print('No valid audio files found'
+                      'in arguments. Nothing to do.')
+        sys.exit()
+    return audio_files
+
+
+def parseAudioDirectories(arguments,
+                          is_recursive=False,
+                          index=None,
+                          jobs=1,
+                          query=None,
+                          sniff=False,
+                          shard=None):
+    errors = []
+    audio_files = list(iterAudioDirectories(arguments,
+                                            is_recursive,
+                                            index,
+                                            jobs,
+                                            errors,
+                                            query,
+                                            sniff,
+                                            shard))
+    reportReadErrors(errors)
+    if not audio_files:
+        console.print(
+            "No valid audio files found in "
+            "the directories given as arguments. Nothing to do."
+        )
+        sys.exit()
+    return audio_files
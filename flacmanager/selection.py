@@ -0,0 +1,163 @@
+import shutil
+
+from prompt_toolkit import prompt
+from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.formatted_text import ANSI
+
+
+class SearchIndex:
+    # Casefolded choices, searched for every whitespace separated term of
+    # the query. A longer query only narrows the matches of its prefix, so
+    # each keystroke filters the previous matches instead of every choice.
+    def __init__(self, choices):
+        self.keys = [str(choice).casefold() for choice in choices]
+        self.cache = {"": list(range(len(self.keys)))}
+
+    def search(self, query):
+        query = query.casefold()
+        if query in self.cache:
+            return self.cache[query]
+        prefix = query[:-1]
+        while prefix not in self.cache:
+            prefix = prefix[:-1]
+        terms = query.split()
+        matches = [index for index in self.cache[prefix]
+                   if all(term in self.keys[index] for term in terms)]
+        self.cache[query] = matches
+        return matches
+
+
+def pickIndices(message, choices, multiple=True):
+    # Returns the indices of the selected choices, in the order of choices,
+    # or the index of the chosen one when multiple is False. Only the
+    # choices that fit in the terminal are rendered, and typing filters
+    # them.
+    index = SearchIndex(choices)
+    state = {"cursor": 0, "top": 0}
+    selected = set()
+    kb = KeyBindings()
+
+    def matches(event):
+        return index.search(event.app.current_buffer.text)
+
+    def move(event, offset):
+        found = matches(event)
+        if found:
+            state["cursor"] = (state["cursor"] + offset) % len(found)
+
+    def page():
+        return max(shutil.get_terminal_size().lines - 4, 1)
+
+    @kb.add("up")
+    def _(event):
+        move(event, -1)
+
+    @kb.add("down")
+    def _(event):
+        move(event, 1)
+
+    @kb.add("pageup")
+    def _(event):
+        state["cursor"] = max(state["cursor"] - page(), 0)
+
+    @kb.add("pagedown")
+    def _(event):
+        state["cursor"] = min(state["cursor"] + page(),
+                              max(len(matches(event)) - 1, 0))
+
+    def toggle(event):
+        found = matches(event)
+        if found:
+            choice = found[min(state["cursor"], len(found) - 1)]
+            if choice in selected:
+                selected.remove(choice)
+            else:
+                selected.add(choice)
+
+    @kb.add("tab")
+    def _(event):
+        if multiple:
+            toggle(event)
+
+    @kb.add(" ")
+    def _(event):
+        # Space toggles until a search is typed, then searches on.
+        if multiple and not event.app.current_buffer.text:
+            toggle(event)
+        else:
+            event.app.current_buffer.insert_text(" ")
+
+    @kb.add("c-a")
+    def _(event):
+        if multiple:
+            selected.update(matches(event))
+
+    @kb.add("c-x")
+    def _(event):
+        selected.clear()
+
+    @kb.add("enter")
+    def _(event):
+        if multiple:
+            event.app.exit(result=sorted(selected))
+            return
+        found = matches(event)
+        if found:
+            event.app.exit(result=found[min(state["cursor"],
+                                            len(found) - 1)])
+
+    def render():
+        from prompt_toolkit.application import get_app
+
+        query = get_app().current_buffer.text
+        found = index.search(query)
+        if query != state.get("query", ""):
+            state["query"] = query
+            state["cursor"] = state["top"] = 0
+        columns, lines = shutil.get_terminal_size()
+        height = max(lines - 4, 1)
+        cursor = state["cursor"] = min(state["cursor"],
+                                       max(len(found) - 1, 0))
+        top = min(state["top"], cursor)
+        if cursor >= top + height:
+            top = cursor - height + 1
+        state["top"] = top
+        if multiple:
+            keys = ("↑↓, Tab/Space: toggle, Ctrl-A: select matches, "
+                    "Ctrl-X: clear, Enter: confirm, type to search")
+            count = f"{len(found)}/{len(choices)}, {len(selected)} selected"
+        else:
+            keys = "↑↓, Enter: confirm, type to search"
+            count = f"{len(found)}/{len(choices)}"
+        output = [f"{message}\x1b[3;90m [{keys}] \x1b[0m",
+                  f"\x1b[90m{count}\x1b[0m"]
+        for position in range(top, min(top + height, len(found))):
+            choice = found[position]
+            text = str(choices[choice])[:max(columns - 7, 1)]
+            mark = ""
+            if multiple:
+                mark = "[\x1b[1;36m*\x1b[0m] " if choice in selected \
+                        else "[ ] "
+            if position == cursor:
+                output.append(f"\x1b[1;36m>\x1b[0m {mark}"
+                              f"\x1b[7;36m{text}\x1b[0m")
+            elif choice in selected:
+                output.append(f"  {mark}\x1b[3;96m{text}\x1b[0m")
+            else:
+                output.append(f"  {mark}{text}")
+        output.append("Search: ")
+        return ANSI("\n".join(output))
+
+    return prompt(render, key_bindings=kb)
+
+
+def listSelection(message, choices):
+    return choices[pickIndices(message, choices, False)]
+
+
+def radioSelection(message, choices):
+    if len(choices) == 0:
+        return []
+    if len(choices) == 1:
+        return [choices[0]]
+    return [choices[index] for index in pickIndices(f"\n{message}", choices)]
@@ -0,0 +1,524 @@
+import argparse
+import json
+import os
+import re
+import signal
+import socket
+import sys
+import time
+
+from pathlib import Path
+from types import SimpleNamespace
+
+from flacmanager.audio import ensureBasicTags, snapshotTags
+from flacmanager.editing import RegexRule, applyChanges, matchesFilter
+from flacmanager.files import (
+        DEFAULT_NAME_TEMPLATE,
+        RenamePlanner,
+        nameTemplate,
+        )
+from flacmanager.index import defaultCacheDirectory, openMetadataIndex
+from flacmanager.journal import WriteJournal
+from flacmanager.query import Query, QueryError
+from flacmanager.scan import (
+        DirectoryListings,
+        readAudioPaths,
+        walkDirectory,
+        )
+from flacmanager.transaction import TagTransaction
+from flacmanager.ui import console
+
+
+SERVER_COMMANDS = ("list", "modify", "rename", "status", "stop")
+DEFAULT_REFRESH_SECONDS = 2.0
+# Seconds a client has to send its request and read the answer.
+CLIENT_TIMEOUT = 10
+
+
+class ServerError(Exception):
+    pass
+
+
+def defaultSocketPath():
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return Path(runtime) / "flacmanager.sock"
+    return defaultCacheDirectory() / "flacmanager.sock"
+
+
+def fileSignature(stat):
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+class LibraryCache:
+    # The tags of every file of the served directories, kept in memory.
+    # refresh() stats the tree and only parses the files that are new or
+    # were modified since, so outside edits are picked up cheaply. Only
+    # the directories whose mtime changed are listed again. Files that
+    # could not be parsed are remembered too, with None as their audio.
+    # A refresh less than max_age seconds after the last one is skipped.
+    def __init__(self, directories, jobs=1, use_index=True, sniff=False):
+        self.directories = [Path(directory) for directory in directories]
+        self.jobs = jobs
+        self.use_index = use_index
+        self.sniff = sniff
+        self.listings = DirectoryListings()
+        self.files = {}
+        self.errors = {}
+        self.refreshed = None
+
+    def refresh(self, max_age=0):
+        if (self.refreshed is not None
+                and time.monotonic() - self.refreshed < max_age):
+            return 0, 0
+        self.refreshed = time.monotonic()
+        signatures = {}
+        changed = []
+        for directory in self.directories:
+            for path in walkDirectory(directory,
+                                      True,
+                                      self.sniff,
+                                      self.listings):
+                try:
+                    signature = fileSignature(os.stat(path))
+                except OSError:
+                    continue
+                signatures[path] = signature
+                entry = self.files.get(path)
+                if entry is None or entry[0] != signature:
+                    changed.append(path)
+        removed = [path for path in self.files if path not in signatures]
+        for path in removed:
+            del self.files[path]
+            self.errors.pop(path, None)
+        if not changed:
+            return 0, len(removed)
+        index = openMetadataIndex() if self.use_index else None
+        try:
+            for path, audio, error in readAudioPaths(changed,
+                                                     index,
+                                                     self.jobs):
+                if error is not None:
+                    self.errors[path] = str(error)
+                else:
+                    self.errors.pop(path, None)
+                if audio is not None and audio.tags is not None:
+                    ensureBasicTags(audio)
+                else:
+                    audio = None
+                self.files[path] = (signatures[path], audio)
+        finally:
+            if index is not None:
+                index.close()
+        return len(changed), len(removed)
+
+    def update(self, path, audio, previous=None):
+        # Records a file the server has just written or renamed, so that
+        # the next refresh does not parse it again.
+        if previous is not None:
+            self.files.pop(previous, None)
+        try:
+            self.files[path] = (fileSignature(os.stat(path)), audio)
+        except OSError:
+            self.files.pop(path, None)
+
+    def select(self, query=None, filter=None):
+        if filter is not None:
+            target_tags = filter[0].split(";")
+            regex = re.compile(filter[1])
+        for path in sorted(self.files):
+            audio = self.files[path][1]
+            if audio is None:
+                continue
+            if query is not None and not query.matches(audio):
+                continue
+            if (filter is not None
+                    and not matchesFilter(audio, regex, target_tags)):
+                continue
+            yield audio, path
+
+    def count(self):
+        return sum(1 for signature, audio in self.files.values()
+                   if audio is not None)
+
+
+class LibraryServer:
+    # Answers one JSON request per connection on a Unix socket. Requests
+    # are handled one at a time, so a write never races a listing.
+    def __init__(self,
+                 library,
+                 socket_path,
+                 write_jobs=1,
+                 journal=True,
+                 refresh_seconds=DEFAULT_REFRESH_SECONDS):
+        self.library = library
+        self.socket_path = Path(socket_path)
+        self.write_jobs = write_jobs
+        self.journal = journal
+        self.refresh_seconds = refresh_seconds
+        self.started = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.requests = 0
+        self.running = False
+
+    def selection(self, request):
+        query = None
+        if request.get("query"):
+            try:
+                query = Query(request["query"])
+            except QueryError as error:
+                raise ServerError(f"Invalid query: {error}") from None
+        filter = request.get("filter")
+        if filter is not None:
+            if len(filter) != 2:
+                raise ServerError("filter takes TAGS and PATTERN.")
+            try:
+                re.compile(filter[1])
+            except re.error as error:
+                raise ServerError(f"Invalid pattern: {error}") from None
+        return list(self.library.select(query, filter))
+
+    def list(self, request):
+        return {"files": [{"path": str(path), "tags": snapshotTags(audio)}
+                          for audio, path in self.selection(request)]}
+
+    def modify(self, request):
+        target_tags = request.get("tags", "")
+        if not target_tags or "value" not in request:
+            raise ServerError("modify takes TAGS and VALUE.")
+        try:
+            rule = RegexRule(request.get("pattern", r'^.*$'),
+                             target_tags.split(";"),
+                             request["value"])
+        except re.error as error:
+            raise ServerError(f"Invalid pattern: {error}") from None
+        audio_files = self.selection(request)
+        journal = None
+        if self.journal:
+            journal = WriteJournal(request.get("argv", ["client", "modify"]))
+        # The index is kept up to date with the saved tags, for the next
+        # scan of these files by the server or any other run.
+        index = openMetadataIndex() if self.library.use_index else None
+        try:
+            with TagTransaction(audio_files,
+                                write_jobs=self.write_jobs,
+                                journal=journal) as transaction:
+                for audio, path in audio_files:
+                    changes = rule.changes(audio)
+                    if changes:
+                        applyChanges(audio, changes)
+        finally:
+            if index is not None:
+                index.close()
+        if journal is not None:
+            journal.close()
+        # Files that could not be saved are parsed again on the next
+        # request, since their tags in memory no longer match the disk.
+        failed = {str(path) for path, error in transaction.errors}
+        for audio, path in audio_files:
+            if str(path) in failed:
+                self.library.files.pop(path, None)
+            else:
+                self.library.update(path, audio)
+        return {"files": len(audio_files),
+                "saved": transaction.saved,
+                "errors": [[str(path), str(error)]
+                           for path, error in transaction.errors]}
+
+    def rename(self, request):
+        try:
+            template = nameTemplate(str(request.get("template")
+                                        or DEFAULT_NAME_TEMPLATE))
+        except argparse.ArgumentTypeError as error:
+            raise ServerError(f"Invalid template: {error}") from None
+        audio_files = self.selection(request)
+        planner = RenamePlanner(template)
+        sources = {id(audio): path for audio, path in audio_files}
+        for audio, path in planner.run(planner.plan(audio_files)):
+            path = Path(path)
+            if path != sources[id(audio)]:
+                self.library.update(path, audio, sources[id(audio)])
+        return {"files": len(audio_files),
+                "renamed": planner.renamed,
+                "unchanged": planner.unchanged,
+                "errors": [[str(path), str(error)]
+                           for path, error in planner.errors]}
+
+    def status(self, request):
+        return {"files": self.library.count(),
+                "directories": [str(directory)
+                                for directory in self.library.directories],
+                "unreadable": len(self.library.errors),
+                "started": self.started,
+                "requests": self.requests}
+
+    def stop(self, request):
+        self.running = False
+        return {}
+
+    def handle(self, request):
+        command = request.get("command")
+        if command not in SERVER_COMMANDS:
+            return {"ok": False, "error": f"Unknown command {command!r}."}
+        self.requests += 1
+        started = time.perf_counter()
+        try:
+            # Writes start from the tags in memory, which have to match the
+            # disk, while listings can do with a recent enough scan.
+            if command in ("modify", "rename") or request.get("refresh"):
+                self.library.refresh()
+            elif command == "list":
+                self.library.refresh(self.refresh_seconds)
+            response = getattr(self, command)(request)
+        except ServerError as error:
+            return {"ok": False, "error": str(error)}
+        except Exception as error:
+            # A failed request must not take the library down with it.
+            console.print_exception()
+            return {"ok": False,
+                    "error": f"{type(error).__name__}: {error}"}
+        response["ok"] = True
+        response["seconds"] = round(time.perf_counter() - started, 6)
+        return response
+
+    def respond(self, connection):
+        # A stalled client must not keep the others waiting.
+        connection.settimeout(CLIENT_TIMEOUT)
+        with connection, connection.makefile("rwb") as stream:
+            try:
+                request = json.loads(stream.readline())
+                if not isinstance(request, dict):
+                    raise ValueError("a request is a JSON object.")
+            except ValueError as error:
+                response = {"ok": False, "error": f"Invalid request: {error}"}
+            else:
+                response = self.handle(request)
+            stream.write(json.dumps(response,
+                                    ensure_ascii=False,
+                                    default=str).encode() + b"\n")
+            stream.flush()
+
+    def bind(self):
+        if self.socket_path.exists():
+            try:
+                sendRequest({"command": "status"}, self.socket_path)
+            except ConnectionError:
+                # Left behind by a server that did not shut down.
+                self.socket_path.unlink()
+            else:
+                raise ServerError(f"A server is already listening on "
+                                  f"{self.socket_path}.")
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # The socket is created readable and writable by its owner only,
+        # rather than restricted once other users could connect to it.
+        umask = os.umask(0o177)
+        try:
+            listener.bind(str(self.socket_path))
+        finally:
+            os.umask(umask)
+        listener.listen()
+        return listener
+
+    def serve(self, listener):
+        self.running = True
+        while self.running:
+            connection, address = listener.accept()
+            try:
+                self.respond(connection)
+            except OSError as error:
+                console.print(f"[bold red]Lost a client: {error}[/]")
+
+
+def sendRequest(request, socket_path=None):
+    if socket_path is None:
+        socket_path = defaultSocketPath()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError) as error:
+            raise ConnectionError(f"No server is listening on "
+                                  f"{socket_path}: {error.strerror}.")
+        with client.makefile("rwb") as stream:
+            stream.write(json.dumps(request).encode() + b"\n")
+            stream.flush()
+            line = stream.readline()
+    finally:
+        client.close()
+    if not line:
+        raise ConnectionError("The server closed the connection.")
+    return json.loads(line)
+
+
+def serveMain(arguments):
+    serve_parser = argparse.ArgumentParser(
+            prog="flacmanager serve",
+            description='Loads the audio files of the directories once and '
+                        'answers flacmanager client requests on a Unix '
+                        'socket.')
+    serve_parser.add_argument("directories",
+                              nargs="+",
+                              help='directories to serve, recursively')
+    serve_parser.add_argument("--socket",
+                              metavar="PATH",
+                              help='Listens on PATH instead of '
+                                   '$XDG_RUNTIME_DIR/flacmanager.sock.')
+    serve_parser.add_argument("-j",
+                              "--jobs",
+                              type=int,
+                              default=1,
+                              metavar="N",
+                              help='Parses files with N worker threads.')
+    serve_parser.add_argument("--write-jobs",
+                              type=int,
+                              default=1,
+                              metavar="N",
+                              help='Saves modified files with N concurrent '
+                                   'writers.')
+    serve_parser.add_argument("--refresh-seconds",
+                              type=float,
+                              default=DEFAULT_REFRESH_SECONDS,
+                              metavar="SECONDS",
+                              help='Answers listings from the last scan of '
+                                   'the directories when it is less than '
+                                   'SECONDS old. Modifications and renames '
+                                   'always scan them first.')
+    serve_parser.add_argument("--sniff",
+                              action="store_true",
+                              help='Also serves the files without an audio '
+                                   'extension that start like an audio file.')
+    serve_parser.add_argument("--no-cache",
+                              action="store_true",
+                              help='Does not read or update the metadata '
+                                   'index.')
+    serve_parser.add_argument("--no-journal",
+                              action="store_true",
+                              help='Does not journal the writes, they cannot '
+                                   'be undone.')
+    args = serve_parser.parse_args(arguments)
+
+    library = LibraryCache(args.directories,
+                           args.jobs,
+                           not args.no_cache,
+                           args.sniff)
+    server = LibraryServer(library,
+                           args.socket or defaultSocketPath(),
+                           args.write_jobs,
+                           not args.no_journal,
+                           args.refresh_seconds)
+    try:
+        listener = server.bind()
+    except ServerError as error:
+        console.print(f"[bold red]{error}[/]")
+        sys.exit(1)
+    # Stopping the server from a service manager removes the socket too.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        with console.status("Loading the library..", spinner="line"):
+            library.refresh()
+        console.print(f"Serving {library.count()} file(s) "
+                      f"on {server.socket_path}.")
+        server.serve(listener)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        server.socket_path.unlink(missing_ok=True)
+
+
+def clientMain(arguments):
+    client_parser = argparse.ArgumentParser(
+            prog="flacmanager client",
+            description='Sends a request to a running flacmanager serve.')
+    client_parser.add_argument("--socket",
+                               metavar="PATH",
+                               help='Connects to PATH instead of '
+                                    '$XDG_RUNTIME_DIR/flacmanager.sock.')
+    commands = client_parser.add_subparsers(dest="command", required=True)
+    # Options of every command, given after its name.
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--json",
+                        action="store_true",
+                        help='Prints the JSON response of the server.')
+    selection = argparse.ArgumentParser(add_help=False, parents=[output])
+    selection.add_argument("-f",
+                           "--filter",
+                           nargs=2,
+                           metavar=("TAGS", "PATTERN"),
+                           help='Only keeps the files matching PATTERN on '
+                                'one of TAGS, separated by ";".')
+    selection.add_argument("-q",
+                           "--query",
+                           help='Only keeps the files matching QUERY.')
+    listing = commands.add_parser("list",
+                                  parents=[selection],
+                                  help='Prints the metadata of the served '
+                                       'files.')
+    listing.add_argument("--refresh",
+                         action="store_true",
+                         help='Scans the served directories first, however '
+                              'recent the last scan is.')
+    modify = commands.add_parser("modify",
+                                 parents=[selection],
+                                 help='Sets TAGS to VALUE.')
+    modify.add_argument("tags", metavar="TAGS")
+    modify.add_argument("value", metavar="VALUE")
+    modify.add_argument("--pattern",
+                        default=r'^.*$',
+                        help='Only replaces what PATTERN matches in TAGS.')
+    rename = commands.add_parser("rename",
+                                 parents=[selection],
+                                 help='Renames files from their tags.')
+    rename.add_argument("--name-template",
+                        type=nameTemplate,
+                        default=DEFAULT_NAME_TEMPLATE,
+                        metavar="TEMPLATE")
+    commands.add_parser("status",
+                        parents=[output],
+                        help='Describes the running server.')
+    commands.add_parser("stop", parents=[output], help='Stops the server.')
+    args = client_parser.parse_args(arguments)
+
+    request = {"command": args.command,
+               "argv": ["client"] + list(arguments)}
+    for option in ("filter", "query", "tags", "value", "pattern"):
+        if getattr(args, option, None) is not None:
+            request[option] = getattr(args, option)
+    if getattr(args, "refresh", False):
+        request["refresh"] = True
+    if args.command == "rename":
+        request["template"] = args.name_template
+    try:
+        response = sendRequest(request, args.socket)
+    except ConnectionError as error:
+        console.print(f"[bold red]{error}[/]")
+        sys.exit(1)
+    if args.json:
+        print(json.dumps(response, ensure_ascii=False))
+    elif not response["ok"]:
+        console.print(f"[bold red]{response['error']}[/]")
+    elif args.command == "list":
+        from flacmanager.ui import printMetadata
+
+        printMetadata((SimpleNamespace(tags=record["tags"]),
+                       Path(record["path"]))
+                      for record in response["files"])
+    elif args.command == "modify":
+        console.print(f"Saved {response['saved']} of {response['files']} "
+                      f"file(s).")
+    elif args.command == "rename":
+        console.print(f"Renamed {response['renamed']} file(s), "
+                      f"{response['unchanged']} already named.")
+    elif args.command == "status":
+        console.print(f"Serving {response['files']} file(s) from "
+                      f"{', '.join(response['directories'])} since "
+                      f"{response['started']}, "
+                      f"{response['requests']} request(s) answered.")
+    if not response["ok"]:
+        sys.exit(1)
+    if response.get("errors"):
+        console.print(f"[bold red]{len(response['errors'])} file(s) "
+                      f"failed:[/]")
+        for path, error in response["errors"]:
+            console.print(f"  {path} : {error}")
+        sys.exit(1)
@@ -0,0 +1,37 @@
+import argparse
+import hashlib
+import re
+
+
+SHARD_MODES = ("album", "path")
+
+
+class Shard:
+    # Files belong to shard index (counting from 1) out of count when the
+    # hash of their key says so. The key is the path relative to the
+    # directory argument it was found under, or the path as given for
+    # file arguments, so hosts mounting the library in different places
+    # agree on the split. With "album", the files of a directory share
+    # their key and always land in the same shard.
+    def __init__(self, index, count, mode="album"):
+        self.index = index
+        self.count = count
+        self.mode = mode
+
+    def owns(self, relative):
+        key = relative.parent if self.mode == "album" else relative
+        digest = hashlib.blake2b(key.as_posix().encode("utf-8",
+                                                       "surrogateescape"),
+                                 digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.count == self.index - 1
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+
+def parseShard(text):
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if match is None or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise argparse.ArgumentTypeError(
+                f"expected K/N with 1 <= K <= N, such as 2/4, not {text!r}")
+    return int(match.group(1)), int(match.group(2))
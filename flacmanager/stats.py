@@ -0,0 +1,186 @@
+import argparse
+import contextlib
+import json
+import time
+
+from flacmanager.ui import console
+
+
+class RunStats:
+    # Wall time, file counts and bytes read or written per phase of a run.
+    active = None
+
+    def __init__(self, shard=None):
+        self.phases = {}
+        self.results = {}
+        self.current = []
+        self.shard = shard
+        self.start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name, files=0):
+        record = self.phases.setdefault(name, {"seconds": 0.0,
+                                               "files": 0,
+                                               "bytes_read": 0,
+                                               "bytes_written": 0})
+        record["files"] += files
+        self.current.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] += time.perf_counter() - start
+            self.current.pop()
+
+    def count(self, bytes_read=0, bytes_written=0):
+        if self.current:
+            self.current[-1]["bytes_read"] += bytes_read
+            self.current[-1]["bytes_written"] += bytes_written
+
+    def summary(self):
+        phases = {}
+        for name, record in self.phases.items():
+            seconds = record["seconds"]
+            phases[name] = dict(record,
+                                files_per_second=(record["files"] / seconds
+                                                  if seconds else None))
+        summary = {"total_seconds": time.perf_counter() - self.start,
+                   "phases": phases,
+                   "results": dict(self.results)}
+        if self.shard is not None:
+            summary["shard"] = self.shard
+        return summary
+
+    def print(self):
+        printSummary(self.summary())
+
+
+def printSummary(summary):
+    from rich import box
+    from rich.table import Table
+
+    table = Table(show_header=True, box=box.MINIMAL_HEAVY_HEAD)
+    table.add_column("Phase", no_wrap=True)
+    table.add_column("Files", no_wrap=True, justify="right")
+    table.add_column("Seconds", no_wrap=True, justify="right")
+    table.add_column("Files/s", no_wrap=True, justify="right")
+    table.add_column("Read MiB", no_wrap=True, justify="right")
+    table.add_column("Written MiB", no_wrap=True, justify="right")
+    for name, record in summary["phases"].items():
+        rate = record["files_per_second"]
+        table.add_row(name,
+                      str(record["files"]),
+                      f"{record['seconds']:.3f}",
+                      f"{rate:.0f}" if rate else "-",
+                      f"{record['bytes_read'] / 1048576:.2f}",
+                      f"{record['bytes_written'] / 1048576:.2f}")
+    console.print(table)
+    results = {name: count
+               for name, count in summary.get("results", {}).items()
+               if count}
+    if results:
+        console.print(", ".join(f"{name.replace('_', ' ')}: {count}"
+                                for name, count in results.items()))
+    console.print(f"Total: {summary['total_seconds']:.3f}s")
+
+
+def mergeSummaries(summaries):
+    # Combines the --stats-json reports of shards run side by side. Counts
+    # add up, and a phase takes as long as its slowest shard, the time of
+    # every shard being kept as busy_seconds.
+    merged = {"total_seconds": 0.0, "phases": {}, "results": {}}
+    shards = []
+    for summary in summaries:
+        merged["total_seconds"] = max(merged["total_seconds"],
+                                      summary.get("total_seconds", 0.0))
+        for name, record in summary.get("phases", {}).items():
+            phase = merged["phases"].setdefault(name, {"seconds": 0.0,
+                                                       "busy_seconds": 0.0,
+                                                       "files": 0,
+                                                       "bytes_read": 0,
+                                                       "bytes_written": 0})
+            phase["seconds"] = max(phase["seconds"], record["seconds"])
+            phase["busy_seconds"] += record["seconds"]
+            for key in ("files", "bytes_read", "bytes_written"):
+                phase[key] += record.get(key, 0)
+        for name, count in summary.get("results", {}).items():
+            merged["results"][name] = merged["results"].get(name, 0) + count
+        if "shard" in summary:
+            shards.append(summary["shard"])
+    for phase in merged["phases"].values():
+        phase["files_per_second"] = (phase["files"] / phase["seconds"]
+                                     if phase["seconds"] else None)
+    if shards:
+        merged["shards"] = shards
+        counts = {shard.split("/")[1] for shard in shards}
+        if len(counts) == 1:
+            count = int(counts.pop())
+            merged["missing_shards"] = [
+                    f"{index}/{count}" for index in range(1, count + 1)
+                    if f"{index}/{count}" not in shards]
+    return merged
+
+
+def mergeMain(arguments):
+    merge_parser = argparse.ArgumentParser(
+            prog="flacmanager merge-stats",
+            description='Combines the --stats-json reports of the shards '
+                        'of a run.')
+    merge_parser.add_argument("reports",
+                              nargs="+",
+                              metavar="FILE",
+                              help='--stats-json report of a shard')
+    merge_parser.add_argument("-o",
+                              "--output",
+                              metavar="FILE",
+                              help='Writes the merged report to FILE as JSON.')
+    args = merge_parser.parse_args(arguments)
+
+    summaries = []
+    for path in args.reports:
+        try:
+            with open(path) as file:
+                summaries.append(json.load(file))
+        except (OSError, ValueError) as error:
+            console.print(f"[bold red]Could not read {path} : {error}[/]")
+    if not summaries:
+        return
+    merged = mergeSummaries(summaries)
+    printSummary(merged)
+    if merged.get("missing_shards"):
+        console.print(f"[bold red]Missing shard(s): "
+                      f"{', '.join(merged['missing_shards'])}[/]")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(merged, file, indent=2)
+            file.write("\n")
+
+
+def measure(name, files=0):
+    if RunStats.active is None:
+        return contextlib.nullcontext()
+    return RunStats.active.phase(name, files)
+
+
+def countResult(name, count=1):
+    if RunStats.active is not None:
+        results = RunStats.active.results
+        results[name] = results.get(name, 0) + count
+
+
+def recordIO(bytes_read=0, bytes_written=0):
+    if RunStats.active is not None:
+        RunStats.active.count(bytes_read, bytes_written)
+
+
+def measureIterator(name, iterator):
+    iterator = iter(iterator)
+    while True:
+        with measure(name) as record:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            if record is not None:
+                record["files"] += 1
+        yield item
@@ -0,0 +1,307 @@
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+from flacmanager.audio import (
+        LazyAudio,
+        audioKind,
+        readFlacLayout,
+        snapshotTags,
+        withoutPlaceholders,
+        )
+from flacmanager.index import MetadataIndex
+from flacmanager.stats import countResult, measure, recordIO
+from flacmanager.ui import console
+
+
+FLAC_DEFAULT_PADDING = 8192
+# Files committed one at a time are saved, and journaled, this many at a
+# time at most.
+COMMIT_BATCH = 64
+
+
+def paddingFunction(budget=None, trim=False):
+    # Keeps whatever padding is left instead of letting mutagen trim it,
+    # which would move the audio frames and rewrite the whole file. When
+    # trim is set the space freed by removed blocks is given back instead.
+    def padding(info):
+        if budget is not None and info.padding < budget:
+            return budget
+        if info.padding >= 0:
+            if trim:
+                return min(info.padding,
+                           max(budget or 0, FLAC_DEFAULT_PADDING))
+            return info.padding
+        return info.get_default_padding()
+    return padding
+
+
+def needsRewrite(audio, budget=None, trim=False):
+    # Predicts whether saving audio will fit in the existing metadata
+    # blocks and padding, or has to move the audio frames.
+    import mutagen.flac
+
+    source = audio
+    if isinstance(audio, LazyAudio):
+        audio = audio.load()
+    if not isinstance(audio, mutagen.flac.FLAC):
+        return True
+    try:
+        available, padding = readFlacLayout(audio.filename)
+    except (OSError, ValueError):
+        return True
+    needed = 4
+    with withoutPlaceholders(source):
+        for block in audio.metadata_blocks:
+            if not isinstance(block, mutagen.flac.Padding):
+                needed += len(mutagen.flac.MetadataBlock._writeblock(block))
+    padding = available - needed
+    if padding < (budget or 0):
+        return True
+    return trim and padding > max(budget or 0, FLAC_DEFAULT_PADDING)
+
+
+class TagTransaction:
+    # Collects the files touched by every action of a run and saves each
+    # of them once, when the transaction is committed. Files whose tags
+    # end up identical to their original values are not written at all.
+    active = None
+
+    def __init__(self,
+                 audio_files=(),
+                 padding=None,
+                 in_place_only=False,
+                 confirm_rewrites=False,
+                 write_jobs=1,
+                 journal=None):
+        self.entries = {}
+        self.pending = []
+        self.padding = padding
+        self.in_place_only = in_place_only
+        self.confirm_rewrites = confirm_rewrites
+        self.write_jobs = max(write_jobs, 1)
+        self.journal = journal
+        self.saved = 0
+        self.unchanged = 0
+        self.rewritten = 0
+        self.rewritten_bytes = 0
+        self.skipped = 0
+        self.errors = []
+        for audio, path in audio_files:
+            self.watch(audio)
+
+    def watch(self, audio):
+        self.entries[id(audio)] = [audio,
+                                   snapshotTags(audio),
+                                   False,
+                                   False,
+                                   False]
+
+    def touch(self, audio, forced=False, trim=False):
+        entry = self.entries.get(id(audio))
+        if entry is None:
+            entry = [audio, None, False, False, False]
+            self.entries[id(audio)] = entry
+        entry[2] = True
+        entry[3] = entry[3] or forced
+        entry[4] = entry[4] or trim
+
+    def modified(self, entry):
+        audio, original, dirty, forced, trim = entry
+        if not dirty:
+            return False
+        if not forced and original == snapshotTags(audio):
+            self.unchanged += 1
+            return False
+        return True
+
+    def plan(self, entries):
+        # Splits the files to save into in-place writes and full rewrites.
+        from mutagen import MutagenError
+
+        in_place = []
+        rewrites = []
+        for entry in entries:
+            try:
+                rewrite = needsRewrite(entry[0], self.padding, entry[4])
+            except (MutagenError, OSError) as error:
+                self.errors.append((entry[0].filename, error))
+                continue
+            if rewrite:
+                rewrites.append(entry)
+            else:
+                in_place.append(entry)
+        return in_place, rewrites
+
+    def write(self, write):
+        # Runs on the writer pool; the bookkeeping is left to flush.
+        from mutagen import MutagenError
+
+        entry, rewrite = write
+        audio = entry[0]
+        try:
+            with withoutPlaceholders(audio):
+                audio.save(padding=paddingFunction(self.padding, entry[4]))
+            if rewrite:
+                return os.path.getsize(audio.filename), None
+            return readFlacLayout(audio.filename)[0], None
+        except (MutagenError, OSError, ValueError) as error:
+            return 0, error
+
+    def flush(self, writes):
+        # Journals the original tags of the whole batch before saving any
+        # file, then saves them with up to write_jobs concurrent writers.
+        if not writes:
+            return
+        if self.journal is not None:
+            self.journal.plan([entry for entry, rewrite in writes])
+        if self.write_jobs > 1 and len(writes) > 1:
+            with ThreadPoolExecutor(min(self.write_jobs,
+                                        len(writes))) as executor:
+                results = list(executor.map(self.write, writes))
+        else:
+            results = map(self.write, writes)
+        for (entry, rewrite), (written, error) in zip(writes, results):
+            audio = entry[0]
+            if error is not None:
+                self.errors.append((audio.filename, error))
+                continue
+            recordIO(bytes_written=written)
+            if MetadataIndex.active is not None:
+                MetadataIndex.active.saved(audio)
+            self.saved += 1
+            if rewrite:
+                self.rewritten += 1
+                self.rewritten_bytes += written
+            if self.journal is not None:
+                self.journal.done(audio.filename)
+            if isinstance(audio, LazyAudio):
+                audio.release()
+        if self.journal is not None:
+            self.journal.sync()
+
+    def writes(self, in_place, rewrites):
+        writes = [(entry, False) for entry in in_place]
+        for entry in rewrites:
+            if self.in_place_only:
+                self.skip(entry)
+            else:
+                writes.append((entry, True))
+        return writes
+
+    def skip(self, entry):
+        self.skipped += 1
+        self.errors.append((entry[0].filename,
+                            "needs a full rewrite, skipped."))
+
+    def flushPending(self):
+        pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with measure("save", len(pending)):
+            self.flush(self.writes(*self.plan(pending)))
+
+    def commit(self, audio=None):
+        if audio is not None:
+            # Files committed one at a time are saved in batches so that
+            # the journal is synced once per batch and the writer pool has
+            # something to work on. Full rewrites are not confirmed, their
+            # count and size are only reported at the end.
+            entry = self.entries.pop(id(audio), None)
+            if entry is None or not self.modified(entry):
+                return
+            self.pending.append(entry)
+            if len(self.pending) >= max(COMMIT_BATCH, self.write_jobs * 4):
+                self.flushPending()
+            return
+        self.flushPending()
+        entries = [entry for entry in self.entries.values()
+                   if self.modified(entry)]
+        self.entries.clear()
+        if not entries:
+            return
+        # The files are planned and saved COMMIT_BATCH at a time, and
+        # released once saved, so that a single batch of them is loaded at
+        # once. Full rewrites are confirmed at the first batch holding any.
+        with console.status("Saving modified files..",
+                            spinner="line") as status, \
+                measure("save", len(entries)):
+            for start in range(0, len(entries), COMMIT_BATCH):
+                batch = entries[start:start + COMMIT_BATCH]
+                in_place, rewrites = self.plan(batch)
+                if (rewrites
+                        and not self.in_place_only
+                        and self.confirm_rewrites):
+                    status.stop()
+                    self.confirmRewrites(len(batch), rewrites)
+                    status.start()
+                self.flush(self.writes(in_place, rewrites))
+
+    def confirmRewrites(self, batch, rewrites):
+        from rich.prompt import Confirm
+
+        self.confirm_rewrites = False
+        rewrite_bytes = sum(os.path.getsize(entry[0].filename)
+                            for entry in rewrites)
+        console.print(f"{len(rewrites)} of the next {batch} file(s) need a "
+                      f"full rewrite ({rewrite_bytes / 1048576:.1f} MiB).")
+        if not Confirm.ask("Rewrite the files that need it? Otherwise only "
+                           "the in-place writes are made"):
+            self.in_place_only = True
+
+    def report(self):
+        countResult("saved", self.saved)
+        countResult("rewritten", self.rewritten)
+        countResult("unchanged", self.unchanged)
+        countResult("skipped", self.skipped)
+        countResult("save_errors", len(self.errors))
+        if self.saved or self.unchanged or self.skipped:
+            console.print(f"Saved {self.saved} file(s) "
+                          f"({self.rewritten} fully rewritten, "
+                          f"{self.rewritten_bytes / 1048576:.1f} MiB), "
+                          f"{self.unchanged} left unchanged, "
+                          f"{self.skipped} skipped.")
+        reportSaveErrors(self.errors)
+
+    def __enter__(self):
+        TagTransaction.active = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        TagTransaction.active = None
+        if exc_type is None:
+            self.commit()
+            self.report()
+
+
+def saveAudio(audio, forced=False, trim=False):
+    transaction = TagTransaction.active
+    if transaction is None:
+        with withoutPlaceholders(audio):
+            audio.save(padding=paddingFunction(trim=trim))
+        if MetadataIndex.active is not None:
+            MetadataIndex.active.saved(audio)
+    else:
+        transaction.touch(audio, forced, trim)
+
+
+def reservePadding(audio_files, budget):
+    # Marks every FLAC file with less than budget bytes of padding so that
+    # it is rewritten once, leaving room for later in-place edits.
+    for audio, path in audio_files:
+        if audioKind(audio) != "FLAC":
+            continue
+        try:
+            available, padding = readFlacLayout(path)
+        except (OSError, ValueError):
+            continue
+        if padding < budget:
+            saveAudio(audio, True)
+
+
+def reportSaveErrors(errors):
+    if not errors:
+        return
+    console.print(f"[bold red]Could not save {len(errors)} file(s):[/]")
+    for path, error in errors:
+        console.print(f"  {path} : {error}")
@@ -0,0 +1,257 @@
+import argparse
+import heapq
+import json
+import os
+import re
+import tempfile
+
+
+class LazyConsole:
+    # Defers importing rich until something is actually printed.
+    def __init__(self, **options):
+        self.console = None
+        self.options = options
+
+    def configure(self, **options):
+        self.options.update(options)
+        self.console = None
+
+    def __getattr__(self, name):
+        if self.console is None:
+            from rich.console import Console
+            self.console = Console(**self.options)
+        return getattr(self.console, name)
+
+
+console = LazyConsole()
+
+
+LIST_COLUMNS = (("Artist", "artist", 10, 20),
+                ("Album", "album", 10, 20),
+                ("Genre", "genre", 5, 20),
+                ("#", "tracknumber", 3, 30),
+                ("Title", "title", 10, 40),
+                ("Filename", "filename", 10, 40))
+LIST_SORT_KEYS = tuple(column[1] for column in LIST_COLUMNS)
+LIST_PAGE_SIZE = 100
+SORT_RUN_SIZE = 10000
+
+
+def listSortKeys(text):
+    keys = [key.strip().lower() for key in text.split(";") if key.strip()]
+    for key in keys:
+        if key not in LIST_SORT_KEYS:
+            raise argparse.ArgumentTypeError(
+                    f"cannot sort on {key!r}, "
+                    f"choose among {', '.join(LIST_SORT_KEYS)}")
+    return keys
+
+
+def pageSize(text):
+    try:
+        rows = int(text)
+    except ValueError:
+        rows = 0
+    if rows < 1:
+        raise argparse.ArgumentTypeError(
+                f"expected a positive number of rows, not {text!r}")
+    return rows
+
+
+def sortValue(key, value):
+    # Track numbers sort as numbers, "10/12" after "9/12", and every
+    # other value without case. Missing values come last.
+    if value is None:
+        return (1, 0, "")
+    if key == "tracknumber":
+        match = re.match(r"\s*(\d+)", value)
+        if match is not None:
+            return (0, int(match.group(1)), value)
+    return (0, 0, value.casefold())
+
+
+class ExternalSorter:
+    # Sorts more rows than should be held in memory: every run_size rows
+    # are sorted and spilled to a temporary file as JSON Lines, and the
+    # runs are merged lazily once iterated. Rows must round-trip through
+    # JSON.
+    def __init__(self, key, run_size=SORT_RUN_SIZE):
+        self.key = key
+        self.run_size = run_size
+        self.run = []
+        self.runs = []
+
+    def add(self, row):
+        self.run.append(row)
+        if len(self.run) >= self.run_size:
+            self.runs.append(spillRun(sorted(self.run, key=self.key)))
+            self.run = []
+
+    def __iter__(self):
+        self.run.sort(key=self.key)
+        try:
+            yield from heapq.merge(*(readRun(file) for file in self.runs),
+                                   self.run,
+                                   key=self.key)
+        finally:
+            for file in self.runs:
+                file.close()
+            self.runs = []
+            self.run = []
+
+
+def spillRun(rows):
+    file = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for row in rows:
+        file.write(json.dumps(row) + "\n")
+    file.seek(0)
+    return file
+
+
+def readRun(file):
+    for line in file:
+        yield json.loads(line)
+
+
+class PagedListing:
+    # Prints the metadata table page by page, so that output starts with
+    # the first page_size files. Column widths are fitted to the first
+    # page and kept for the following ones, which are rendered as tables
+    # of their own and line up with it. Sorted listings go through an
+    # external sort and are printed once every file has been added.
+    def __init__(self,
+                 regex=None,
+                 target_tags=LIST_SORT_KEYS,
+                 style=None,
+                 sort_keys=(),
+                 page_size=LIST_PAGE_SIZE):
+        self.regex = re.compile(regex) if regex is not None else None
+        self.target_tags = target_tags
+        self.style = style
+        self.page_size = page_size
+        self.widths = None
+        self.page = []
+        self.pages = 0
+        self.sorter = None
+        if sort_keys:
+            positions = [LIST_SORT_KEYS.index(key) for key in sort_keys]
+            self.sorter = ExternalSorter(
+                    lambda values: [sortValue(LIST_SORT_KEYS[position],
+                                              values[position])
+                                    for position in positions])
+
+    def add(self, audio, path):
+        values = []
+        for title, tag, min_width, max_width in LIST_COLUMNS:
+            if tag == "filename":
+                values.append(path.name)
+            elif audio.tags.get(tag):
+                values.append(str(audio.tags[tag][0]))
+            else:
+                values.append(None)
+        if self.sorter is not None:
+            # The first page is only kept as a sample for the widths.
+            self.sorter.add(values)
+            if self.widths is None:
+                self.page.append(values)
+                if len(self.page) >= self.page_size:
+                    self.fitWidths()
+                    self.page = []
+            return
+        self.page.append(values)
+        if len(self.page) >= self.page_size:
+            self.flushPage()
+
+    def fitWidths(self):
+        self.widths = [
+                max(min_width,
+                    min(max_width,
+                        max((len(values[number] or "")
+                             for values in self.page), default=0)))
+                for number, (title, tag, min_width, max_width)
+                in enumerate(LIST_COLUMNS)]
+
+    def flushPage(self):
+        from rich import box
+        from rich.markup import escape
+        from rich.table import Table
+
+        if self.widths is None:
+            self.fitWidths()
+        table = Table(show_header=self.pages == 0,
+                      show_edge=False,
+                      box=box.MINIMAL_HEAVY_HEAD)
+        for (title, tag, min_width, max_width), width in zip(LIST_COLUMNS,
+                                                             self.widths):
+            table.add_column(title, no_wrap=True, width=width)
+        for values in self.page:
+            record = []
+            for (title, tag, min_width, max_width), value in zip(LIST_COLUMNS,
+                                                                 values):
+                value = value or ""
+                if (self.regex is not None
+                        and tag in self.target_tags
+                        and self.regex.search(value)):
+                    record.append(f"[{self.style}]{escape(value)}")
+                else:
+                    record.append(escape(value))
+            table.add_row(*record)
+        console.print(table)
+        self.pages += 1
+        self.page = []
+
+    def close(self):
+        if self.sorter is not None:
+            if self.widths is None:
+                self.fitWidths()
+            self.page = []
+            for values in self.sorter:
+                self.page.append(values)
+                if len(self.page) >= self.page_size:
+                    self.flushPage()
+        if self.page:
+            self.flushPage()
+
+
+def printMetadata(audio_files,
+                  regex=None,
+                  target_tags=("artist",
+                               "album",
+                               "genre",
+                               "tracknumber",
+                               "title"),
+                  style=None,
+                  sort_keys=(),
+                  page_size=LIST_PAGE_SIZE):
+    listing = PagedListing(regex, target_tags, style, sort_keys, page_size)
+    for audio, path in audio_files:
+        listing.add(audio, path)
+    listing.close()
+
+
+def printPreview(preview):
+    from rich.table import Table
+    from rich.text import Text
+
+    if not preview:
+        console.print("[bold green]No changes detected.[/bold green]")
+        return
+    table = Table(show_header=True, header_style="bold")
+    table.add_column("Tag", no_wrap=True, min_width=5, max_width=15)
+    table.add_column("Old Value", no_wrap=True, style="red", max_width=30)
+    table.add_column("New Value", no_wrap=True, style="green", max_width=30)
+    table.add_column("Filename",  no_wrap=True, overflow="fold", max_width=30)
+    for file_preview in preview:
+        path = file_preview["path"]
+        changes = file_preview["changes"]
+        for tag, vals in changes.items():
+            old = vals["old"]
+            new = vals["new"]
+            if old != new:
+                old_text = Text(old, style="red")
+                new_text = Text(new, style="green")
+            else:
+                old_text = Text(old)
+                new_text = Text(new)
+            table.add_row(tag, old_text, new_text, os.path.basename(path))
+    console.print(table)
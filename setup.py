@@ -4,5 +4,17 @@ setup(
     name="flacman",
     version="1.0.0",
     packages=find_packages(),
+    install_requires=[
+        "mutagen",
+        "rich",
+        "prompt_toolkit",
+    ],
+    extras_require={
+        "resize": ["Pillow"],
+    },
+    entry_points={
+        "console_scripts": [
+            "flacmanager=flacmanager.cli:main",
+        ],
+    },
 )
-
@@ -0,0 +1,62 @@
+import pytest
+
+from flacmanager.audio import (
+        FLAC_BLOCK_PADDING,
+        FLAC_BLOCK_VORBIS_COMMENT,
+        flacBlocks,
+        readFlacTags,
+        )
+from flacmanager.bench import flacBlock, writeSyntheticFlac
+
+
+def id3Header(size):
+    # ID3v2.4 header with a syncsafe size and no footer.
+    syncsafe = bytes((size >> shift) & 0x7F for shift in (21, 14, 7, 0))
+    return b"ID3\x04\x00\x00" + syncsafe
+
+
+def test_read_flac_tags_reads_the_vorbis_comment(tmp_path):
+    path = tmp_path / "track.flac"
+    writeSyntheticFlac(path, [("TITLE", "x"), ("artist", "y")])
+    tags, bytes_read = readFlacTags(path)
+    assert tags == {"title": ["x"], "artist": ["y"]}
+    assert bytes_read < path.stat().st_size
+
+
+def test_read_flac_tags_leaves_a_truncated_block_to_mutagen(tmp_path):
+    path = tmp_path / "track.flac"
+    writeSyntheticFlac(path, [("title", "x" * 100)], padding=0)
+    data = path.read_bytes()
+    path.write_bytes(data[:data.index(b"x" * 100) + 50])
+    assert readFlacTags(path)[0] is None
+
+
+def test_read_flac_tags_without_vorbis_comment_is_empty(tmp_path):
+    path = tmp_path / "track.flac"
+    path.write_bytes(b"fLaC" + flacBlock(FLAC_BLOCK_PADDING, bytes(16), True))
+    assert readFlacTags(path)[0] == {}
+
+
+def test_read_flac_tags_skips_an_id3_header(tmp_path):
+    path = tmp_path / "track.flac"
+    writeSyntheticFlac(path, [("title", "x")])
+    path.write_bytes(id3Header(32) + bytes(32) + path.read_bytes())
+    assert readFlacTags(path)[0] == {"title": ["x"]}
+
+
+def test_flac_blocks_rejects_a_truncated_header(tmp_path):
+    path = tmp_path / "track.flac"
+    comment = flacBlock(FLAC_BLOCK_VORBIS_COMMENT, bytes(8))
+    path.write_bytes(b"fLaC" + comment + b"\x81\x00")
+    with open(path, "rb") as file:
+        blocks = flacBlocks(file)
+        assert next(blocks) == (FLAC_BLOCK_VORBIS_COMMENT, 8)
+        with pytest.raises(ValueError):
+            next(blocks)
+
+
+def test_flac_blocks_rejects_a_file_without_marker(tmp_path):
+    path = tmp_path / "track.flac"
+    path.write_bytes(id3Header(0) + b"RIFF")
+    with open(path, "rb") as file, pytest.raises(ValueError):
+        next(flacBlocks(file))
@@ -0,0 +1,24 @@
+from collections import Counter
+
+from flacmanager.consistency import clusterValues, normalizeValue
+
+
+def test_normalize_value_ignores_case_spacing_and_leading_article():
+    assert normalizeValue("The Beatles") == "beatles"
+    assert normalizeValue("Beatles, The") == "beatles"
+    assert normalizeValue("the  beatles ") == "beatles"
+
+
+def test_normalize_value_keeps_words_that_are_not_english_articles():
+    assert normalizeValue("De Staat") == "de staat"
+    assert normalizeValue("I Monster") == "i monster"
+
+
+def test_cluster_values_joins_typos_but_not_numbers():
+    clusters = clusterValues(Counter({"The Beatles": 3,
+                                      "The Beatels": 1,
+                                      "Vol. 1": 2,
+                                      "Vol. 2": 2,
+                                      "Staat": 1,
+                                      "De Staat": 1}))
+    assert sorted(map(sorted, clusters)) == [["The Beatels", "The Beatles"]]
@@ -0,0 +1,78 @@
+import argparse
+import os
+
+from types import SimpleNamespace
+
+import pytest
+
+from flacmanager.files import RenamePlanner, SortPlanner, nameTemplate
+
+
+def audioFile(path, **tags):
+    path.write_bytes(b"")
+    tags = {tag: [value] for tag, value in tags.items()}
+    return SimpleNamespace(filename=str(path), tags=tags), path
+
+
+def test_rename_keeps_the_name_of_a_file_already_named(tmp_path):
+    audio_files = [audioFile(tmp_path / "0.flac", tracknumber="1", title="x"),
+                   audioFile(tmp_path / "1 - x.flac",
+                             tracknumber="1",
+                             title="x")]
+    planner = RenamePlanner()
+    moves = planner.plan(audio_files)
+    assert [destination.name for audio, source, destination in moves] \
+        == ["1 - x (2).flac", "1 - x.flac"]
+    planner.run(moves)
+    assert planner.errors == []
+    assert sorted(path.name for path in tmp_path.iterdir()) \
+        == ["1 - x (2).flac", "1 - x.flac"]
+
+
+def test_sort_reports_collisions_instead_of_overwriting(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    audio_files = [audioFile(tmp_path / "a" / "1.flac", artist="x", album="y"),
+                   audioFile(tmp_path / "b" / "1.flac", artist="x", album="y"),
+                   audioFile(tmp_path / "b" / "2.flac", artist="x", album="y")]
+    base = tmp_path / "sorted"
+    (base / "x" / "y").mkdir(parents=True)
+    (base / "x" / "y" / "2.flac").write_bytes(b"kept")
+    planner = SortPlanner(base)
+    result = planner.run(planner.plan(audio_files))
+    assert [path for audio, path in result] \
+        == [base / "x" / "y" / "1.flac",
+            tmp_path / "b" / "1.flac",
+            tmp_path / "b" / "2.flac"]
+    assert [source for source, error in planner.errors] \
+        == [tmp_path / "b" / "1.flac", tmp_path / "b" / "2.flac"]
+    assert (base / "x" / "y" / "2.flac").read_bytes() == b"kept"
+    assert planner.renamed == 1
+
+
+def test_sort_copies_then_removes_across_devices(tmp_path):
+    audio, path = audioFile(tmp_path / "1.flac", artist="x", album="y")
+    path.write_bytes(b"audio")
+    planner = SortPlanner(tmp_path / "sorted")
+    directory = tmp_path / "sorted" / "x" / "y"
+    # Pretends the destination lives on another filesystem.
+    directory.mkdir(parents=True)
+    planner.directories[directory] = os.stat(tmp_path).st_dev + 1
+    planner.run(planner.plan([(audio, path)]))
+    assert (planner.renamed, planner.copied, planner.copied_bytes) \
+        == (0, 1, 5)
+    assert not path.exists()
+    assert (directory / "1.flac").read_bytes() == b"audio"
+    assert audio.filename == str(directory / "1.flac")
+
+
+@pytest.mark.parametrize("template", ["{title", "{title!x}", "{title.upper}",
+                                      "{title[0]}", "{}"])
+def test_name_template_rejects_malformed_fields(template):
+    with pytest.raises(argparse.ArgumentTypeError):
+        nameTemplate(template)
+
+
+def test_name_template_accepts_tags_and_format_specs():
+    assert nameTemplate("{tracknumber:02} - {title}") \
+        == "{tracknumber:02} - {title}"
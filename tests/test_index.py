@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from flacmanager.audio import LazyAudio
+from flacmanager.index import MetadataIndex
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(tmp_path / "index.sqlite3")
+    yield index
+    index.close()
+
+
+def storedTrack(index, path, title="x"):
+    path.write_bytes(b"0123456789")
+    index.store(path, os.stat(path), LazyAudio(path, {"title": [title]},
+                                               "FLAC"))
+    return path
+
+
+def test_lookup_returns_the_tags_of_a_fresh_entry(tmp_path, index):
+    path = storedTrack(index, tmp_path / "track.flac")
+    audio = index.lookup(path, os.stat(path))
+    assert audio.tags == {"title": ["x"]}
+    assert audio.kind == "FLAC"
+    assert (index.hits, index.misses) == (1, 0)
+
+
+def test_lookup_misses_once_the_size_changed(tmp_path, index):
+    path = storedTrack(index, tmp_path / "track.flac")
+    stat = os.stat(path)
+    path.write_bytes(b"01234567890")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert index.lookup(path, os.stat(path)) is None
+    assert index.misses == 1
+
+
+def test_lookup_misses_once_the_mtime_changed(tmp_path, index):
+    path = storedTrack(index, tmp_path / "track.flac")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert index.lookup(path, os.stat(path)) is None
+
+
+def test_saved_replaces_the_entry_with_the_new_tags(tmp_path, index):
+    path = storedTrack(index, tmp_path / "track.flac")
+    audio = LazyAudio(path, {"title": ["y"]}, "FLAC")
+    path.write_bytes(b"9876543210")
+    index.saved(audio)
+    assert index.lookup(path, os.stat(path)).tags == {"title": ["y"]}
+
+
+def test_reindex_ignores_fresh_entries(tmp_path):
+    path = tmp_path / "index.sqlite3"
+    index = MetadataIndex(path)
+    track = storedTrack(index, tmp_path / "track.flac")
+    index.close()
+    index = MetadataIndex(path, reindex=True)
+    try:
+        assert index.lookup(track, os.stat(track)) is None
+    finally:
+        index.close()
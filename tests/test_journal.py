@@ -0,0 +1,78 @@
+import json
+
+import mutagen
+import pytest
+
+from flacmanager.bench import writeSyntheticFlac
+from flacmanager.journal import journalMain, readJournal
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+
+
+def writeJournal(path, records):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(json.dumps({"started": "2026-01-01 00:00:00",
+                               "argv": ["-m", "title", "new"]}) + "\n")
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+
+
+def interruptedRun(tmp_path):
+    # Two files planned, only the first one saved before the interruption.
+    tracks = [tmp_path / "1.flac", tmp_path / "2.flac"]
+    writeSyntheticFlac(tracks[0], [("title", "new")])
+    writeSyntheticFlac(tracks[1], [("title", "old")])
+    journal = tmp_path / "run.jsonl"
+    writeJournal(journal,
+                 [{"path": str(track),
+                   "kind": "FLAC",
+                   "before": {"title": ["old"]},
+                   "after": {"title": ["new"]}} for track in tracks]
+                 + [{"done": str(tracks[0])}])
+    return journal, tracks
+
+
+def titles(tracks):
+    return [mutagen.File(track)["title"] for track in tracks]
+
+
+def test_read_journal_keeps_the_first_and_last_tags(tmp_path):
+    journal = tmp_path / "run.jsonl"
+    writeJournal(journal,
+                 [{"path": "a", "before": {"title": ["1"]},
+                   "after": {"title": ["2"]}},
+                  {"done": "a"},
+                  {"path": "a", "before": {"title": ["2"]},
+                   "after": {"title": ["3"]}}])
+    with open(journal, "a", encoding="utf-8") as file:
+        file.write('{"done": ')
+    header, files, done, finished = readJournal(journal)
+    assert files["a"]["before"] == {"title": ["1"]}
+    assert files["a"]["after"] == {"title": ["3"]}
+    assert done == set()
+    assert not finished
+
+
+def test_resume_finishes_the_run_once(tmp_path, capsys):
+    journal, tracks = interruptedRun(tmp_path)
+    journalMain("resume", [str(journal), "-y"])
+    assert titles(tracks) == [["new"], ["new"]]
+    assert "Saved 1 file(s)" in capsys.readouterr().out
+    mtimes = [track.stat().st_mtime_ns for track in tracks]
+    journalMain("resume", [str(journal), "-y"])
+    assert [track.stat().st_mtime_ns for track in tracks] == mtimes
+    assert "Saved 0 file(s)" in capsys.readouterr().out
+
+
+def test_undo_restores_the_original_tags_once(tmp_path, capsys):
+    journal, tracks = interruptedRun(tmp_path)
+    journalMain("undo", [str(journal), "-y"])
+    assert titles(tracks) == [["old"], ["old"]]
+    assert "Saved 1 file(s)" in capsys.readouterr().out
+    mtimes = [track.stat().st_mtime_ns for track in tracks]
+    journalMain("undo", [str(journal), "-y"])
+    assert [track.stat().st_mtime_ns for track in tracks] == mtimes
+    assert "Saved 0 file(s)" in capsys.readouterr().out
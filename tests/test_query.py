@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from flacmanager.audio import LazyAudio
+from flacmanager.index import MetadataIndex
+from flacmanager.query import Query, QueryError
+
+
+TRACKS = [{"artist": ["Bach"], "genre": ["Classical"], "tracknumber": ["3/12"],
+           "title": ["Prelude"]},
+          {"artist": ["The Beatles", "John Lennon"], "genre": ["Rock"],
+           "tracknumber": ["12"], "title": ["Let It Be (live)"]},
+          {"artist": [""], "genre": ["rock"], "date": ["2001-05-03"],
+           "title": ["Untitled"]},
+          {"title": ["No tags"]}]
+QUERIES = ['artist ~ "^Bach"',
+           "genre = ROCK",
+           "genre != rock",
+           "tracknumber < 10",
+           "tracknumber >= 12",
+           "date > 2000",
+           "has artist",
+           "missing artist",
+           "title !~ live and not genre = classical",
+           '(artist = "john lennon" or has date) and title ~ "^[LU]"']
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(tmp_path / "index.sqlite3")
+    yield index
+    index.close()
+
+
+def test_query_predicate_and_sql_agree(tmp_path, index):
+    tracks = []
+    for number, tags in enumerate(TRACKS):
+        path = tmp_path / f"{number}.flac"
+        path.write_bytes(b"")
+        audio = LazyAudio(path, tags, "FLAC")
+        index.store(path, os.stat(path), audio)
+        tracks.append((audio, path))
+    for text in QUERIES:
+        query = Query(text)
+        for audio, path in tracks:
+            matched = index.match(path, query.sql, query.params)[3]
+            assert bool(matched) == query.matches(audio), (text, path.name)
+
+
+def test_query_prefilter_only_skips_fresh_entries_that_do_not_match(
+        tmp_path, index):
+    paths = []
+    for number, tags in enumerate(TRACKS):
+        path = tmp_path / f"{number}.flac"
+        path.write_bytes(b"")
+        index.store(path, os.stat(path), LazyAudio(path, tags, "FLAC"))
+        paths.append(path)
+    paths[0].write_bytes(b"modified")
+    query = Query("genre = rock")
+    assert list(query.prefilter(paths, index)) == paths[:3]
+
+
+@pytest.mark.parametrize("text", ["artist", "artist = ", "(genre = rock",
+                                  "tracknumber < x", "title ~ ("])
+def test_query_rejects_malformed_queries(text):
+    with pytest.raises(QueryError):
+        Query(text)
@@ -0,0 +1,20 @@
+from flacmanager.selection import SearchIndex
+
+
+CHOICES = ["Abbey Road", "Let It Be", "Revolver", "Rubber Soul", "Help!"]
+
+
+def fresh(query):
+    return SearchIndex(CHOICES).search(query)
+
+
+def test_search_matches_every_term_without_case():
+    index = SearchIndex(CHOICES)
+    assert index.search("r") == [0, 2, 3]
+    assert index.search("ROAD ab") == [0]
+
+
+def test_search_does_not_reuse_the_matches_of_another_query():
+    index = SearchIndex(CHOICES)
+    for query in ("re", "rev", "re", "ru", "rub", "l", "le", "he", "", "x"):
+        assert index.search(query) == fresh(query), query
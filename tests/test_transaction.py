@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import mutagen
+
+from flacmanager.bench import writeSyntheticFlac
+from flacmanager.transaction import (
+        FLAC_DEFAULT_PADDING,
+        needsRewrite,
+        paddingFunction,
+        )
+
+
+def flacWithPadding(path, padding):
+    writeSyntheticFlac(path, [("title", "x")], padding=padding)
+    return mutagen.File(path)
+
+
+def paddingInfo(padding):
+    return SimpleNamespace(padding=padding, get_default_padding=lambda: 1024)
+
+
+def test_needs_rewrite_when_a_tag_fits_the_padding_exactly(tmp_path):
+    audio = flacWithPadding(tmp_path / "track.flac", 1024)
+    # An entry takes its length on 4 bytes plus "key=value".
+    audio["comment"] = "x" * (1024 - 4 - len("comment="))
+    assert not needsRewrite(audio)
+
+
+def test_needs_rewrite_when_a_tag_is_one_byte_too_long(tmp_path):
+    audio = flacWithPadding(tmp_path / "track.flac", 1024)
+    audio["comment"] = "x" * (1024 - 4 - len("comment=") + 1)
+    assert needsRewrite(audio)
+
+
+def test_needs_rewrite_when_the_padding_is_below_the_budget(tmp_path):
+    audio = flacWithPadding(tmp_path / "track.flac", 1024)
+    assert not needsRewrite(audio, 1024)
+    assert needsRewrite(audio, 1025)
+
+
+def test_needs_rewrite_to_trim_a_large_padding(tmp_path):
+    audio = flacWithPadding(tmp_path / "track.flac",
+                            FLAC_DEFAULT_PADDING + 1)
+    assert not needsRewrite(audio)
+    assert needsRewrite(audio, trim=True)
+    assert not needsRewrite(audio, FLAC_DEFAULT_PADDING + 1, trim=True)
+
+
+def test_padding_function_keeps_the_padding_left():
+    assert paddingFunction()(paddingInfo(100)) == 100
+    assert paddingFunction()(paddingInfo(-10)) == 1024
+    assert paddingFunction(4096)(paddingInfo(100)) == 4096
+
+
+def test_padding_function_trims_to_the_default_padding():
+    padding = paddingFunction(trim=True)
+    assert padding(paddingInfo(100)) == 100
+    assert padding(paddingInfo(100000)) == FLAC_DEFAULT_PADDING
+    assert paddingFunction(16384, True)(paddingInfo(100000)) == 16384